@@ -0,0 +1,331 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+""" bench.py: Micro benchmarks of the LSB pipeline
+
+usage: bench.py [NAME ...]
+
+Run every benchmark, or only the ones named on the command line.
+Each benchmark prints one line per measured variant.
+
+Author : Vincent Brignatz
+"""
+
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import lsb
+import png
+
+
+def measure(fn, repeat=5):
+    """ Best wall time of repeat calls to fn, in seconds.
+        (Callable, int) ~> (float)
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def report(name, seconds, nbytes):
+    """ Print one benchmark line with its throughput. """
+    print(f"{name:<40} {seconds * 1000:9.2f} ms {nbytes / seconds / 2**20:9.1f} MiB/s")
+
+def bench_seal():
+    """ Embedding of a sealed payload against the plain framed path. """
+    size = 2**20
+    payload = bytes(range(256)) * (size // 256)
+    pixels = bytearray(4 * (size + 1024))
+    report("hide_payload plain", measure(lambda: lsb.hide_payload(pixels, payload)), size)
+    report("hide_payload sealed", measure(lambda: lsb.hide_payload(pixels, payload, key="k")), size)
+    report("find_payload plain", measure(lambda: lsb.find_payload(pixels)), size)
+    lsb.hide_payload(pixels, payload, key="k")
+    report("find_payload sealed", measure(lambda: lsb.find_payload(pixels, key="k")), size)
+
+def bench_cache():
+    """ Decoding a carrier against fetching it from the LRU cache. """
+    path = "images/rgb.png"
+    cache = lsb.CarrierCache()
+    pixels = cache.get(path).buffer
+    report("load_rgba", measure(lambda: lsb.load_rgba(path)), len(pixels))
+    report("load_rgba cached", measure(lambda: lsb.load_rgba(path, cache)), len(pixels))
+
+def bench_partial():
+    """ Hiding a short message in a tall carrier, with and without restart points. """
+    width, height = 1000, 4000
+    pixels = bytearray(os.urandom(4 * width * height))
+    with tempfile.TemporaryDirectory() as tmp:
+        src, dst = os.path.join(tmp, "src.png"), os.path.join(tmp, "dst.png")
+        for interval in (None, lsb.RESTART_INTERVAL):
+            with open(src, "wb") as f:
+                lsb.write_rgba(f, width, height, pixels, restart_interval=interval)
+            name = f"hide_in_png restart_interval={interval}"
+            report(name, measure(lambda: lsb.hide_in_png(src, dst, b"secret" * 100), repeat=3), len(pixels))
+
+def bench_trns():
+    """ Decoding RGB carriers with and without a tRNS chunk. """
+    width, height = 1000, 1000
+    rows = [os.urandom(3 * width) for _ in range(height)]
+    for transparent in (None, (1, 2, 3)):
+        f = io.BytesIO()
+        png.Writer(width, height, greyscale=False, transparent=transparent).write(f, rows)
+        data = f.getvalue()
+        report(f"asDirect transparent={transparent}",
+               measure(lambda: list(png.Reader(bytes=data).asDirect()[2]), repeat=3), 3 * width * height)
+
+def bench_pack():
+    """ Encoding greyscale carriers at low bit depths. """
+    width, height = 2000, 1000
+    for bitdepth in (1, 2, 4):
+        rows = [bytearray(b & (2**bitdepth - 1) for b in os.urandom(width)) for _ in range(height)]
+        w = png.Writer(width, height, greyscale=True, bitdepth=bitdepth)
+        report(f"Writer.write bitdepth={bitdepth}",
+               measure(lambda: w.write(io.BytesIO(), rows), repeat=3), width * height)
+
+def bench_sixteen():
+    """ Encoding and decoding 16 bits per channel carriers. """
+    width, height = 1000, 1000
+    rows = [png.array("H", os.urandom(8 * width)) for _ in range(height)]
+    w = png.Writer(width, height, greyscale=False, alpha=True, bitdepth=16, compression=1)
+    f = io.BytesIO()
+    report("Writer.write bitdepth=16", measure(lambda: w.write(io.BytesIO(), rows), repeat=3), 8 * width * height)
+    w.write(f, rows)
+    data = f.getvalue()
+    report("Reader.read bitdepth=16",
+           measure(lambda: list(png.Reader(bytes=data).read()[2]), repeat=3), 8 * width * height)
+
+def bench_raster():
+    """ Decoding a carrier into a list of rows against a single raster buffer. """
+    width, height = 1000, 1000
+    f = io.BytesIO()
+    png.Writer(width, height, greyscale=False, alpha=True).write_array(f, os.urandom(4 * width * height))
+    data = f.getvalue()
+    report("Reader.read list of rows",
+           measure(lambda: list(png.Reader(bytes=data).read()[2]), repeat=3), 4 * width * height)
+    report("Reader.read_raster",
+           measure(lambda: png.Reader(bytes=data).read_raster(), repeat=3), 4 * width * height)
+    buffer = bytearray(4 * width * height)
+    report("Reader.read_into reused buffer",
+           measure(lambda: png.Reader(bytes=data).read_into(buffer), repeat=3), 4 * width * height)
+
+def bench_import():
+    """ Importing the modules, and reading a message in process against a new process. """
+    for module in ("png", "lsb", "main"):
+        command = [sys.executable, "-c", f"import {module}"]
+        report(f"python -c 'import {module}'", measure(lambda: subprocess.run(command, check=True)), 0)
+    with tempfile.TemporaryDirectory() as tmp:
+        dst = os.path.join(tmp, "dst.png")
+        command = [sys.executable, "main.py", "-f", dst, "-m", "read", "-k", ""]
+        lsb.embed("images/rgb.png", dst, b"secret", key="")
+        report("main.py -m read (new process)",
+               measure(lambda: subprocess.run(command, check=True, stdout=subprocess.DEVNULL)), 0)
+        report("lsb.extract (in process)", measure(lambda: lsb.extract(dst, key="")), 0)
+
+def bench_pipeline():
+    """ Hiding a message in a large RGB carrier, serially and on pipelined threads. """
+    width, height = 2000, 2000
+    pixels = bytearray(os.urandom(width * height)) * 3
+    with tempfile.TemporaryDirectory() as tmp:
+        src, dst = os.path.join(tmp, "src.png"), os.path.join(tmp, "dst.png")
+        with open(src, "wb") as f:
+            png.Writer(width, height, greyscale=False).write_array(f, pixels)
+        data = b"secret" * 1000
+        report("hide_in_png serial", measure(lambda: lsb.hide_in_png(src, dst, data), repeat=3), len(pixels))
+        report("hide_in_png pipeline=8",
+               measure(lambda: lsb.hide_in_png(src, dst, data, pipeline=8), repeat=3), len(pixels))
+
+def bench_bands():
+    """ Decoding a carrier with restart points, serially and band by band on threads. """
+    width, height = 2000, 2000
+    f = io.BytesIO()
+    png.Writer(width, height, greyscale=False, alpha=True,
+               restart_interval=lsb.RESTART_INTERVAL).write_array(f, os.urandom(4 * width * height))
+    data = f.getvalue()
+    buffer = bytearray(4 * width * height)
+    for workers in (1, 4):
+        report(f"Reader.read_into workers={workers}",
+               measure(lambda: png.Reader(bytes=data).read_into(buffer, workers=workers), repeat=3), len(buffer))
+
+def bench_rows():
+    """ Decoding 32 rows at the bottom of a carrier with restart points, against the whole carrier. """
+    width, height = 1000, 4000
+    f = io.BytesIO()
+    png.Writer(width, height, greyscale=False, alpha=True,
+               restart_interval=lsb.RESTART_INTERVAL).write_array(f, os.urandom(4 * width * height))
+    data = f.getvalue()
+    report("Reader.read_raster", measure(lambda: png.Reader(bytes=data).read_raster(), repeat=3), len(data))
+    report("Reader.read_rows 32 bottom rows",
+           measure(lambda: png.Reader(bytes=data).read_rows(height - 40, height - 8), repeat=3), len(data))
+
+def bench_region():
+    """ Hiding and reading a message from the top rows, against a rectangle chosen in a textured area. """
+    width, height = 1000, 4000
+    pixels = bytearray(4 * width * height)
+    # Only the bottom half is textured
+    pixels[len(pixels) // 2:] = os.urandom(len(pixels) // 2)
+    data = b"secret" * 1000
+    with tempfile.TemporaryDirectory() as tmp:
+        src, dst = os.path.join(tmp, "src.png"), os.path.join(tmp, "dst.png")
+        with open(src, "wb") as f:
+            lsb.write_rgba(f, width, height, pixels)
+        for region in (None, True):
+            report(f"embed region={region}",
+                   measure(lambda: lsb.embed(src, dst, data, region=region), repeat=3), len(data))
+            report(f"extract region={region}",
+                   measure(lambda: lsb.extract(dst, region=region), repeat=3), len(data))
+
+def bench_verify():
+    """ Decoding a large carrier split in many IDAT chunks, with each checksum verify policy. """
+    width, height = 2000, 2000
+    f = io.BytesIO()
+    png.Writer(width, height, greyscale=False, alpha=True, compression=1,
+               chunk_limit=2**13).write_array(f, os.urandom(4 * width * height))
+    data = f.getvalue()
+    buffer = bytearray(4 * width * height)
+    for verify in png.Reader.VERIFY:
+        report(f"Reader.read_into verify={verify}",
+               measure(lambda: png.Reader(bytes=data, verify=verify).read_into(buffer), repeat=3), len(data))
+
+def bench_pipe():
+    """ Encoding a carrier into a pipe, with small and large IDAT chunks. """
+    width, height = 1000, 1000
+    pixels = os.urandom(4 * width * height)
+    # Stored (level 0) deflate, so that the writes are what is measured
+    variants = (
+        {"compression": 0},
+        {"compression": 0, "buffer_size": 2**10, "idat_size": 2**10},
+        {"compression": 0, "buffer_size": 2**10, "idat_size": 2**16},
+        {"compression": 0, "restart_interval": 4},
+    )
+
+    def write(w):
+        r, fd = os.pipe()
+        with os.fdopen(r, "rb") as reader:
+            drain = threading.Thread(target=reader.read)
+            drain.start()
+            with os.fdopen(fd, "wb", buffering=0) as f:
+                w.write_array(f, pixels)
+            drain.join()
+
+    for options in variants:
+        w = png.Writer(width, height, greyscale=False, alpha=True, **options)
+        name = " ".join(f"{k}={v}" for k, v in options.items() if k != "compression")
+        report(f"Writer.write pipe {name or 'default'}", measure(lambda: write(w), repeat=3), len(pixels))
+
+def bench_stream():
+    """ Decoding a carrier split in many IDAT chunks from a pipe, with and without readahead, against a file. """
+    width, height = 1000, 1000
+    buffer = bytearray(4 * width * height)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "src.png")
+        with open(path, "wb") as f:
+            png.Writer(width, height, greyscale=False, alpha=True, compression=1,
+                       idat_size=2**13).write_array(f, os.urandom(len(buffer)))
+
+        def from_pipe(readahead, bufsize):
+            with subprocess.Popen(["cat", path], stdout=subprocess.PIPE, bufsize=bufsize) as cat:
+                png.Reader(file=cat.stdout, readahead=readahead).read_into(buffer)
+
+        report("Reader.read_into file", measure(lambda: png.Reader(filename=path).read_into(buffer)), len(buffer))
+        # A buffered pipe without readahead, then an unbuffered one
+        # (like a socket: every read is a system call, and may be short)
+        for readahead, bufsize in ((0, -1), (2**16, 0), (2**20, 0)):
+            report(f"Reader.read_into pipe readahead={readahead}",
+                   measure(lambda: from_pipe(readahead, bufsize)), len(buffer))
+
+def bench_async():
+    """ Concurrent embeds on one event loop, blocking it against embed_async, with the longest stall of the loop. """
+    import asyncio
+    import socket
+
+    width, height, n_requests = 400, 400, 50
+    f = io.BytesIO()
+    lsb.write_rgba(f, width, height, bytearray(os.urandom(4 * width * height)))
+    carrier = f.getvalue()
+
+    async def blocking(payload):
+        lsb.embed(io.BytesIO(carrier), io.BytesIO(), payload)
+
+    async def streamed(payload):
+        a, b = socket.socketpair()
+        reader, writer = await asyncio.open_connection(sock=a)
+        client_reader, client_writer = await asyncio.open_connection(sock=b)
+        client_writer.write(carrier)
+        client_writer.write_eof()
+        received = asyncio.ensure_future(client_reader.read())
+        await lsb.embed_async(reader, writer, payload)
+        writer.close()
+        await received
+        client_writer.close()
+
+    async def run(embed):
+        stall = 0
+        done = False
+
+        async def heartbeat():
+            nonlocal stall
+            while not done:
+                t0 = time.perf_counter()
+                await asyncio.sleep(0.001)
+                stall = max(stall, time.perf_counter() - t0)
+
+        beat = asyncio.ensure_future(heartbeat())
+        t0 = time.perf_counter()
+        await asyncio.gather(*(embed(b"secret %d" % i) for i in range(n_requests)))
+        seconds = time.perf_counter() - t0
+        done = True
+        await beat
+        return seconds, stall
+
+    for name, embed in (("embed in the loop", blocking), ("embed_async", streamed)):
+        seconds, stall = asyncio.run(run(embed))
+        report(f"{n_requests} x {name}", seconds, n_requests * len(carrier))
+        print(f"{'  longest stall of the loop':<40} {stall * 1000:9.2f} ms")
+
+def bench_stored():
+    """ Hiding a message in a large carrier in place, its image data stored uncompressed, against re-encoding its bands. """
+    width, height = 2000, 2000
+    pixels = bytearray(os.urandom(4 * width * height))
+    data = b"secret" * 1000
+    with tempfile.TemporaryDirectory() as tmp:
+        src, dst = os.path.join(tmp, "src.png"), os.path.join(tmp, "dst.png")
+        for stored in (False, True):
+            with open(src, "wb") as f:
+                lsb.write_rgba(f, width, height, pixels, stored=stored)
+            # In place, nothing is copied
+            report(f"embed stored={stored}",
+                   measure(lambda: lsb.embed(src, src, data), repeat=3), len(data))
+            report(f"embed stored={stored} copy",
+                   measure(lambda: lsb.embed(src, dst, data), repeat=3), len(data))
+
+
+BENCHMARKS = {
+    "seal": bench_seal,
+    "cache": bench_cache,
+    "partial": bench_partial,
+    "trns": bench_trns,
+    "pack": bench_pack,
+    "sixteen": bench_sixteen,
+    "raster": bench_raster,
+    "import": bench_import,
+    "pipeline": bench_pipeline,
+    "bands": bench_bands,
+    "rows": bench_rows,
+    "region": bench_region,
+    "verify": bench_verify,
+    "pipe": bench_pipe,
+    "stream": bench_stream,
+    "async": bench_async,
+    "stored": bench_stored,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
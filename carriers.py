@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+""" carriers.py: Persistent index of the png files usable as carriers
+
+usage: carriers.py [-h] -d DATABASE [-u PATH [PATH ...]] [-n MIN_BYTES]
+                   [-c CHANNELS] [-b {1,2,4,8}] [-s]
+optional arguments:
+  -h, --help            show this help message and exit
+  -d DATABASE, --database DATABASE
+                        The sqlite file holding the index
+  -u PATH [PATH ...], --update PATH [PATH ...]
+                        Index these png files (directories are walked)
+  -n MIN_BYTES, --min-bytes MIN_BYTES
+                        Print the carriers able to hold this many bytes
+  -c CHANNELS, --channels CHANNELS
+                        The RGBA channels holding the message (default: RG)
+  -b {1,2,4,8}, --bits {1,2,4,8}
+                        The number of LSB replaced in each channel (default: 4)
+  -s, --sealed          The payload will be encrypted
+
+The metadata of each png (read from the chunks before IDAT, nothing is
+inflated) is stored in a sqlite database, keyed by path. An entry is
+only refreshed when the modification time or the size of its file
+changed, so updating a large library is cheap. Picking a carrier for a
+message is then a single indexed query.
+
+Author : Vincent Brignatz
+"""
+
+import argparse
+import os
+import sqlite3
+
+import cipher
+import lsb
+import png
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS carriers (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    pixels INTEGER NOT NULL,
+    bitdepth INTEGER NOT NULL,
+    color_type INTEGER NOT NULL,
+    interlace INTEGER NOT NULL,
+    palette INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS carriers_pixels ON carriers (pixels);
+"""
+
+COLUMNS = "path mtime_ns size width height pixels bitdepth color_type interlace palette".split()
+
+
+def read_metadata(path, stat):
+    """ Metadata of a png file, as a row of the carriers table.
+        (str, os.stat_result) ~> (Tuple)
+    """
+    with open(path, "rb") as f:
+        r = png.Reader(file=f)
+        r.preamble()
+    palette = len(r.plte) // 3 if r.plte else 0
+    return (path, stat.st_mtime_ns, stat.st_size, r.width, r.height,
+            r.width * r.height, r.bitdepth, r.color_type, r.interlace, palette)
+
+def iter_png(paths):
+    """ Yield the png files among paths, walking the directories.
+        (Iterable<str>) ~> (Iterator<str>)
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, _, names in os.walk(path):
+            for name in sorted(names):
+                if name.lower().endswith(".png"):
+                    yield os.path.join(root, name)
+
+def min_pixels(n_bytes, scheme=lsb.DEFAULT_SCHEME, sealed=False):
+    """ Number of pixels needed to hold a framed payload of n_bytes.
+        (int, Scheme, bool) ~> (int)
+
+        >>> min_pixels(96)
+        100
+    """
+    n_bytes += lsb.HEADER.size
+    if sealed:
+        n_bytes += cipher.OVERHEAD
+    n_slots = n_bytes * lsb.slots_per_byte(scheme)
+    return -(-n_slots // len(scheme.channels))
+
+
+class CarrierIndex:
+    """ Index of carriers stored in a sqlite database. """
+
+    def __init__(self, database):
+        self.db = sqlite3.connect(database)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def update(self, paths):
+        """ Add or refresh the entries of the png files among paths.
+            Files that did not change since they were indexed are not opened,
+            the entries of the ones removed or broken since are deleted.
+            Return the number of refreshed entries.
+            (Iterable<str>) ~> (int)
+        """
+        known = {row["path"]: (row["mtime_ns"], row["size"])
+                 for row in self.db.execute("SELECT path, mtime_ns, size FROM carriers")}
+        fresh, broken = [], []
+        for path in iter_png(paths):
+            path = os.path.abspath(path)
+            try:
+                stat = os.stat(path)
+                if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                fresh.append(read_metadata(path, stat))
+            except (png.Error, OSError):
+                # Removed, or not a (valid) png file (anymore): it cannot be a carrier
+                if path in known:
+                    broken.append((path,))
+        with self.db:
+            self.db.executemany(f"INSERT OR REPLACE INTO carriers VALUES ({', '.join('?' * len(COLUMNS))})", fresh)
+            self.db.executemany("DELETE FROM carriers WHERE path = ?", broken)
+        return len(fresh)
+
+    def prune(self):
+        """ Remove the entries whose file does not exist anymore.
+            Return the number of removed entries.
+            () ~> (int)
+        """
+        gone = [(row["path"],) for row in self.db.execute("SELECT path FROM carriers")
+                if not os.path.exists(row["path"])]
+        with self.db:
+            self.db.executemany("DELETE FROM carriers WHERE path = ?", gone)
+        return len(gone)
+
+    def select(self, n_bytes, scheme=lsb.DEFAULT_SCHEME, sealed=False, limit=None):
+        """ Entries of the carriers able to hold a payload of n_bytes,
+            smallest first.
+            (int, Scheme, bool, int) ~> (List<sqlite3.Row>)
+        """
+        query = "SELECT * FROM carriers WHERE pixels >= ? ORDER BY pixels"
+        params = [min_pixels(n_bytes, scheme, sealed)]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return self.db.execute(query, params).fetchall()
+
+    def pick(self, n_bytes, scheme=lsb.DEFAULT_SCHEME, sealed=False):
+        """ Path of the smallest carrier able to hold n_bytes, or None.
+            (int, Scheme, bool) ~> (str)
+        """
+        rows = self.select(n_bytes, scheme, sealed, limit=1)
+        return rows[0]["path"] if rows else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Persistent index of the png files usable as carriers')
+    parser.add_argument('-d', "--database", type=str, required=True,
+                        help='The sqlite file holding the index')
+    parser.add_argument('-u', "--update", type=str, nargs="+", default=[], metavar="PATH",
+                        help='Index these png files (directories are walked)')
+    parser.add_argument('-n', "--min-bytes", type=int, default=None,
+                        help='Print the carriers able to hold this many bytes')
+    parser.add_argument('-c', "--channels", type=str, default="RG",
+                        help='The RGBA channels holding the message (default: RG)')
+    parser.add_argument('-b', "--bits", type=int, choices=[1, 2, 4, 8], default=4,
+                        help='The number of LSB replaced in each channel (default: 4)')
+    parser.add_argument('-s', "--sealed", action="store_true",
+                        help='The payload will be encrypted')
+    args = parser.parse_args()
+
+    with CarrierIndex(args.database) as index:
+        if args.update:
+            print(f"{index.update(args.update)} carriers indexed, {index.prune()} removed")
+        if args.min_bytes is not None:
+            scheme = lsb.make_scheme(args.channels, args.bits)
+            for row in index.select(args.min_bytes, scheme, args.sealed):
+                print(row["path"])
+
+if __name__ == "__main__":
+    main()
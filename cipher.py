@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+""" cipher.py: Authenticated encryption of the payload hidden in a png file
+
+Only the standard library is used, so a sealed payload can be opened
+on any machine that can run main.py.
+
+The construction is encrypt-then-MAC:
+  - a fresh random salt is drawn for every message;
+  - PBKDF2-HMAC-SHA256 derives an encryption key and a MAC key from the
+    passphrase and the salt (so the keystream is never reused);
+  - the keystream is the SHAKE-256 output of the encryption key, and is
+    xored with the whole plaintext in a single bulk operation;
+  - an HMAC-SHA256 tag covers the salt and the ciphertext.
+
+Sealed layout : salt (16 bytes) | ciphertext | tag (32 bytes)
+
+Author : Vincent Brignatz
+"""
+
+import hashlib
+import hmac
+import os
+
+SALT_SIZE = 16
+KEY_SIZE = 32
+TAG_SIZE = 32
+ITERATIONS = 100000
+
+# Number of bytes a sealed payload is longer than its plaintext.
+OVERHEAD = SALT_SIZE + TAG_SIZE
+
+
+class AuthenticationError(ValueError):
+    """ The sealed payload was altered, or the key is wrong. """
+
+
+def derive_keys(key, salt):
+    """ Derive the encryption and the MAC keys from a passphrase.
+        (str|bytes, bytes) ~> (bytes, bytes)
+    """
+    if isinstance(key, str):
+        key = key.encode("utf-8")
+    material = hashlib.pbkdf2_hmac("sha256", key, salt, ITERATIONS, 2 * KEY_SIZE)
+    return material[:KEY_SIZE], material[KEY_SIZE:]
+
+def xor_keystream(enc_key, data):
+    """ Xor data with the keystream of enc_key, in one pass.
+        (bytes, bytes) ~> (bytes)
+
+        >>> k = bytes(32)
+        >>> xor_keystream(k, xor_keystream(k, b"abc"))
+        b'abc'
+    """
+    n = len(data)
+    if n == 0:
+        return b""
+    stream = hashlib.shake_256(enc_key).digest(n)
+    mixed = int.from_bytes(data, "big") ^ int.from_bytes(stream, "big")
+    return mixed.to_bytes(n, "big")
+
+def seal(key, plaintext):
+    """ Encrypt and authenticate plaintext with the passphrase key.
+        (str|bytes, bytes) ~> (bytes)
+    """
+    salt = os.urandom(SALT_SIZE)
+    enc_key, mac_key = derive_keys(key, salt)
+    body = salt + xor_keystream(enc_key, plaintext)
+    return body + hmac.new(mac_key, body, hashlib.sha256).digest()
+
+def unseal(key, sealed):
+    """ Verify and decrypt a payload produced by seal.
+        (str|bytes, bytes) ~> (bytes)
+
+        Raise AuthenticationError if the tag does not match.
+    """
+    sealed = bytes(sealed)
+    if len(sealed) < OVERHEAD:
+        raise AuthenticationError("The sealed payload is too short")
+    body, tag = sealed[:-TAG_SIZE], sealed[-TAG_SIZE:]
+    enc_key, mac_key = derive_keys(key, body[:SALT_SIZE])
+    if not hmac.compare_digest(tag, hmac.new(mac_key, body, hashlib.sha256).digest()):
+        raise AuthenticationError("The payload is corrupted or the key is wrong")
+    return xor_keystream(enc_key, body[SALT_SIZE:])
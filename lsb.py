@@ -0,0 +1,1423 @@
+# -*- coding: utf-8 -*-
+
+""" lsb.py: Hide bytes in the least significant bits of RGBA pixels
+
+The pixels are a flat sequence of RGBA samples, row after row: a
+bytearray for 8 bits per sample, or an array('H') for the pictures
+stored with 16 bits per sample (their 16 bits are kept, so only the
+imperceptible low bits of each sample change). A scheme tells which
+channels of each pixel are used and how many of their least
+significant bits are replaced. Each payload byte is split into
+8/bits pieces (most significant first), which fill the chosen
+channels pixel after pixel. The default scheme writes the high
+nibble in the R channel and the low nibble in the G channel.
+
+A framed payload starts with its length (4 bytes, big endian), so it
+can be read back without scanning the whole picture.
+When a key is given the payload is sealed (see cipher.py) before
+being framed.
+
+embed and extract are the entry points for other programs (main.py
+is a thin command line wrapper around them), embed_async and
+extract_async their counterparts for asyncio streams. cipher.py is only
+imported once a key is used, to keep importing this module cheap.
+
+Author : Vincent Brignatz
+"""
+
+import collections
+import contextlib
+import functools
+import io
+import itertools
+import mmap
+import operator
+import os
+import queue
+import struct
+import sys
+import threading
+import zlib
+
+from array import array
+
+import png
+
+HEADER = struct.Struct("!I")
+
+# Header of a payload written in a rectangle: REGION_MAGIC (whose last
+# byte is the version of the header), its x, y, width and height (in
+# pixels), then its length
+REGION = struct.Struct("!4s5I")
+REGION_MAGIC = b"RGN\x01"
+
+# Rows per band of the png files written by this module (see png.Writer)
+RESTART_INTERVAL = 32
+
+CHANNELS = "RGBA"
+
+# channels: indexes in the RGBA pixel, bits: LSB replaced in each channel
+Scheme = collections.namedtuple("Scheme", "channels bits")
+
+DEFAULT_SCHEME = Scheme((0, 1), 4)
+
+# Translation tables for a number of bits, so that every operation on
+# the pieces of the payload is done in bulk.
+Tables = collections.namedtuple("Tables", "split join clear low")
+
+
+class CapacityError(ValueError):
+    """ The payload does not fit in the picture. """
+
+
+def make_scheme(channels="RG", bits=4):
+    """ Build a scheme from channel letters and a number of bits.
+        (str, int) ~> (Scheme)
+
+        >>> make_scheme("RG", 4)
+        Scheme(channels=(0, 1), bits=4)
+    """
+    channels = channels.upper()
+    if not channels or any(c not in CHANNELS for c in channels) or len(set(channels)) != len(channels):
+        raise ValueError(f"The channels must be distinct letters among {CHANNELS}, not '{channels}'")
+    if bits not in (1, 2, 4, 8):
+        raise ValueError(f"The number of bits must be 1, 2, 4 or 8, not {bits}")
+    return Scheme(tuple(CHANNELS.index(c) for c in channels), bits)
+
+@functools.lru_cache(maxsize=None)
+def tables(bits):
+    """ Translation tables to split bytes into pieces of bits and back.
+        (int) ~> (Tables)
+    """
+    mask = 2**bits - 1
+    shifts = range(8 - bits, -1, -bits)
+    split = tuple(bytes((b >> s) & mask for b in range(256)) for s in shifts)
+    join = tuple(bytes(((b & mask) << s) & 0xff for b in range(256)) for s in shifts)
+    clear = bytes(b & ~mask & 0xff for b in range(256))
+    low = bytes(b & mask for b in range(256))
+    return Tables(split, join, clear, low)
+
+def slots_per_byte(scheme):
+    return 8 // scheme.bits
+
+def capacity_bytes(width, height, scheme=DEFAULT_SCHEME, sealed=False, framed=True):
+    """ Usable payload bytes of a width x height picture.
+        A framed payload pays for its length header,
+        a sealed one (always framed) for the cipher overhead too.
+        (int, int, Scheme, bool, bool) ~> (int)
+
+        >>> capacity_bytes(10, 10)
+        96
+    """
+    total = width * height * len(scheme.channels) // slots_per_byte(scheme)
+    if framed or sealed:
+        total -= HEADER.size
+    if sealed:
+        import cipher
+        total -= cipher.OVERHEAD
+    return max(0, total)
+
+def capacity(path, scheme=DEFAULT_SCHEME, sealed=False, framed=True):
+    """ Usable payload bytes of a png file (a path, or a binary file).
+        Only the chunks before the image data are read, nothing is inflated.
+        (str|BinaryIO, Scheme, bool, bool) ~> (int)
+    """
+    with open_file(path, "rb") as f:
+        r = png.Reader(file=f)
+        r.preamble()
+    return capacity_bytes(r.width, r.height, scheme, sealed, framed)
+
+def flatten(rows, typecode=None):
+    """ Concatenate rows of samples into a single bytearray,
+        or an array of typecode.
+        (Iterable<Sequence<int>>, str) ~> (bytearray|array)
+    """
+    pixels = bytearray() if typecode is None else array(typecode)
+    for row in rows:
+        pixels.extend(row)
+    return pixels
+
+def copy_raster(raster):
+    """ A fresh, modifiable copy of a png.Raster.
+        (png.Raster) ~> (png.Raster)
+    """
+    buffer = raster.buffer
+    if isinstance(buffer, array):
+        buffer = array(buffer.typecode, buffer)
+    else:
+        buffer = bytearray(buffer)
+    return png.Raster(raster.width, raster.height, raster.planes, raster.bitdepth, buffer, raster.info)
+
+def load_raster(path, cache=None, bitdepth=None, raster=None, stats=None, workers=1):
+    """ Decode a png file into a png.Raster of RGBA pixels.
+        Pictures stored with 16 bits per sample keep them (the buffer
+        is an array('H')), unless bitdepth is 8; the other pictures
+        are rescaled to 8 bits per sample (the buffer is a bytearray).
+        The samples stored in the file are used with all their bits,
+        an sBIT chunk would otherwise discard the ones holding the data.
+        The raster is a fresh copy, that can be modified freely.
+        When a cache is given, it is used to skip the decoding.
+        RGBA pictures are decoded straight into the buffer, which is
+        the one of raster when it is given with the same dimensions:
+        a worker decoding similar carriers then allocates nothing.
+        Their bands of rows (see RESTART_INTERVAL) are inflated ahead on
+        workers threads (see png.Reader.read_into), the unfiltering
+        stays on this one.
+        The decoding stages are recorded in stats, if given.
+        (str, CarrierCache, int, png.Raster, png.Stats, int) ~> (png.Raster)
+    """
+    if cache is not None:
+        return cache.get(path, bitdepth)
+    r = png.Reader(filename=path, stats=stats)
+    try:
+        r.preamble()
+        if r.color_type == 6 and r.bitdepth == (bitdepth or r.bitdepth):
+            shape = (r.width, r.height, 4, r.bitdepth)
+            if raster is None or (raster.width, raster.height, raster.planes, raster.bitdepth) != shape:
+                raster = png.Raster(*shape)
+            raster.info = r.read_into(raster.buffer, workers=workers)[3]
+            return raster
+        if r.bitdepth == 16 and bitdepth != 8:
+            return r.read_raster(functools.partial(r.asRGBA, sbit=False))
+        return r.read_raster(functools.partial(r.asRGBA8, sbit=False))
+    finally:
+        r.file.close()
+
+def load_rgba(path, cache=None, bitdepth=None):
+    """ Decode a png file into flat RGBA pixels (see load_raster).
+        (str, CarrierCache, int) ~> (int, int, bytearray|array)
+    """
+    raster = load_raster(path, cache, bitdepth)
+    return raster.width, raster.height, raster.buffer
+
+def load_rgba8(path, cache=None):
+    """ Decode a png file into flat RGBA pixels, 8 bits per sample.
+        (str, CarrierCache) ~> (int, int, bytearray)
+    """
+    return load_rgba(path, cache, bitdepth=8)
+
+
+class CarrierCache:
+    """ Size bounded LRU cache of decoded carriers.
+
+        Each carrier is kept as a png.Raster (one compact buffer per
+        picture), never handed out. An entry is dropped when the file
+        it comes from changes (modification time or size), and the
+        least recently used entries are evicted once max_bytes is
+        exceeded. It can be shared between threads. The carriers are
+        decoded with workers threads each (see load_raster).
+    """
+
+    def __init__(self, max_bytes=256 * 2**20, workers=1):
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, path, bitdepth=None):
+        """ Decoded raster of path (see load_raster), as a fresh copy.
+            (str, int) ~> (png.Raster)
+        """
+        path = os.path.abspath(path)
+        key = (path, bitdepth)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                _, raster, _ = entry
+                return copy_raster(raster)
+            self.misses += 1
+        raster = load_raster(path, bitdepth=bitdepth, workers=self.workers)
+        self.put(key, version, copy_raster(raster))
+        return raster
+
+    def put(self, key, version, raster):
+        size = len(raster.buffer) * getattr(raster.buffer, "itemsize", 1)
+        with self.lock:
+            self.discard(key)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (version, raster, size)
+            self.n_bytes += size
+            while self.n_bytes > self.max_bytes:
+                self.discard(next(iter(self.entries)))
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.n_bytes -= entry[2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.n_bytes = 0
+
+
+def merge(*parts):
+    """ Bitwise or of byte strings of the same length.
+        (bytes, ...) ~> (bytes)
+    """
+    merged = 0
+    for part in parts:
+        merged |= int.from_bytes(part, "big")
+    return merged.to_bytes(len(parts[0]), "big")
+
+def slices(n_slots, scheme, start, planes=4):
+    """ For each channel of scheme, the slice of the pixels holding its
+        slots, and the slice of the pieces going into it.
+        (int, Scheme, int, int) ~> (Iterator<Tuple<slice, slice>>)
+    """
+    nch = len(scheme.channels)
+    for k, channel in enumerate(scheme.channels):
+        # First slot, from start, that goes in this channel
+        first = start + (k - start) % nch
+        count = len(range(first, start + n_slots, nch))
+        lo = (first // nch) * planes + channel
+        yield slice(lo, lo + count * planes, planes), slice(first - start, None, nch)
+
+def clear_low(samples, bits):
+    """ Samples with their bits least significant bits set to 0.
+        (bytearray|array, int) ~> (bytes|array)
+    """
+    if isinstance(samples, array):
+        keep = ~(2**bits - 1) & (2**(8 * samples.itemsize) - 1)
+        return array(samples.typecode, map(operator.and_, samples, itertools.repeat(keep)))
+    return samples.translate(tables(bits).clear)
+
+def set_low(cleared, pieces):
+    """ Cleared samples with pieces written in their low bits.
+        (bytes|array, bytes) ~> (bytes|array)
+    """
+    if isinstance(cleared, array):
+        return array(cleared.typecode, map(operator.or_, cleared, pieces))
+    return merge(cleared, pieces)
+
+def get_low(samples, bits):
+    """ The bits least significant bits of samples.
+        (bytearray|array, int) ~> (bytes)
+    """
+    if isinstance(samples, array):
+        return bytes(map(operator.and_, samples, itertools.repeat(2**bits - 1)))
+    return samples.translate(tables(bits).low)
+
+def check_capacity(pixels, n_slots, scheme, start, planes=4):
+    available = len(pixels) // planes * len(scheme.channels) - start
+    if n_slots > available:
+        n = n_slots // slots_per_byte(scheme)
+        raise CapacityError(f"The data ({n} bytes) is too fat for the image you have "
+                            f"choosen ({available // slots_per_byte(scheme)} bytes left)")
+
+def split_pieces(data, scheme=DEFAULT_SCHEME):
+    """ The pieces of bits of data, one per slot, most significant first.
+        (bytes, Scheme) ~> (bytearray)
+
+        >>> split_pieces(b"a")
+        bytearray(b'\\x06\\x01')
+    """
+    spb = slots_per_byte(scheme)
+    data = bytes(data)
+    pieces = bytearray(len(data) * spb)
+    for i, table in enumerate(tables(scheme.bits).split):
+        pieces[i::spb] = data.translate(table)
+    return pieces
+
+def hide_pieces(pixels, pieces, scheme=DEFAULT_SCHEME, start=0):
+    """ Write pieces (see split_pieces) in the pixels, from slot start.
+        (bytearray|array, bytes, Scheme, int) ~> (bytearray|array)
+    """
+    for target, source in slices(len(pieces), scheme, start):
+        pixels[target] = set_low(clear_low(pixels[target], scheme.bits), pieces[source])
+    return pixels
+
+def hide_bytes(pixels, data, scheme=DEFAULT_SCHEME, start=0):
+    """ Write data in the pixels following scheme, from slot start.
+        (bytearray|array, bytes, Scheme, int) ~> (bytearray|array)
+
+        >>> hide_bytes(bytearray([1, 2, 3, 0, 4, 5, 6, 0]), b"ab")
+        bytearray(b'\\x06\\x01\\x03\\x00\\x06\\x02\\x06\\x00')
+    """
+    n_slots = len(data) * slots_per_byte(scheme)
+    if n_slots == 0:
+        return pixels
+    check_capacity(pixels, n_slots, scheme, start)
+    return hide_pieces(pixels, split_pieces(data, scheme), scheme, start)
+
+def hide_rows(rows, data, scheme=DEFAULT_SCHEME, typecode="B"):
+    """ Yield the rows of RGBA pixels, with data written in the first ones.
+        The rows are streamed: each one is written and handed on before
+        the next one is read. Rows that are not a bytearray or an array
+        are converted to one of typecode ('B' or 'H').
+        (Iterable<Sequence<int>>, bytes, Scheme, str) ~> (Iterator<bytearray|array>)
+    """
+    pieces = split_pieces(data, scheme)
+    done = 0
+    for row in rows:
+        if done < len(pieces):
+            if not isinstance(row, (bytearray, array)):
+                row = bytearray(row) if typecode == "B" else array(typecode, row)
+            n = min(len(row) // 4 * len(scheme.channels), len(pieces) - done)
+            hide_pieces(row, pieces[done:done + n], scheme)
+            done += n
+        yield row
+    if done < len(pieces):
+        n = len(pieces) // slots_per_byte(scheme)
+        raise CapacityError(f"The data ({n} bytes) is too fat for the image you have choosen")
+
+def threaded(iterable, maxsize=8):
+    """ Yield the items of iterable, iterated in a worker thread.
+        The worker runs at most maxsize items ahead (it waits for the
+        consumer otherwise), and its exceptions are raised in the
+        consumer. Chaining threaded iterators builds a pipeline whose
+        stages overlap where they release the GIL (zlib does).
+        (Iterable, int) ~> (Iterator)
+    """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+    end = object()
+
+    def work():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                items.put((item, None))
+            items.put((end, None))
+        except BaseException as e:
+            items.put((end, e))
+
+    worker = threading.Thread(target=work, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is end:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        # The consumer stopped early: unblock and wait for the worker
+        stop.set()
+        while worker.is_alive():
+            try:
+                items.get(timeout=0.01)
+            except queue.Empty:
+                pass
+
+def find_bytes(pixels, n, scheme=DEFAULT_SCHEME, start=0):
+    """ Read n bytes from the pixels following scheme, from slot start.
+        (bytearray|array, int, Scheme, int) ~> (bytes)
+
+        >>> find_bytes(bytearray(b'\\x06\\x01\\x03\\x00\\x06\\x02\\x06\\x00'), 2)
+        b'ab'
+    """
+    n_slots = n * slots_per_byte(scheme)
+    if n_slots == 0:
+        return b""
+    check_capacity(pixels, n_slots, scheme, start)
+    return join_pieces(find_pieces(pixels, n_slots, scheme, start), scheme)
+
+def find_pieces(pixels, n_slots, scheme=DEFAULT_SCHEME, start=0):
+    """ Read the pieces of n_slots slots from the pixels, from slot start.
+        (bytearray|array, int, Scheme, int) ~> (bytearray)
+    """
+    pieces = bytearray(n_slots)
+    for target, source in slices(n_slots, scheme, start):
+        pieces[source] = get_low(pixels[target], scheme.bits)
+    return pieces
+
+def join_pieces(pieces, scheme=DEFAULT_SCHEME):
+    """ Inverse of split_pieces: the bytes made of the pieces.
+        (bytes, Scheme) ~> (bytes)
+
+        >>> join_pieces(b"\\x06\\x01")
+        b'a'
+    """
+    spb = slots_per_byte(scheme)
+    if not pieces:
+        return b""
+    return merge(*(pieces[i::spb].translate(table) for i, table in enumerate(tables(scheme.bits).join)))
+
+def pack_payload(data, key=None):
+    """ Seal data if a key is given, then frame it by its length.
+        (bytes, str|bytes) ~> (bytes)
+    """
+    if key is not None:
+        import cipher
+        data = cipher.seal(key, data)
+    return HEADER.pack(len(data)) + data
+
+def hide_payload(pixels, data, key=None, scheme=DEFAULT_SCHEME):
+    """ Seal data if a key is given, then write it framed by its length.
+        (bytearray, bytes, str|bytes, Scheme) ~> (bytearray)
+    """
+    return hide_bytes(pixels, pack_payload(data, key), scheme)
+
+def find_payload(pixels, key=None, scheme=DEFAULT_SCHEME):
+    """ Read a framed payload, and verify and decrypt it if a key is given.
+        (bytearray, str|bytes, Scheme) ~> (bytes)
+    """
+    (n,) = HEADER.unpack(find_bytes(pixels, HEADER.size, scheme))
+    start = HEADER.size * slots_per_byte(scheme)
+    try:
+        data = find_bytes(pixels, n, scheme, start)
+    except CapacityError:
+        raise CapacityError("No payload found: the length header is out of the image")
+    if key is not None:
+        import cipher
+        data = cipher.unseal(key, data)
+    return data
+
+def rows_touched(n_bytes, width, scheme=DEFAULT_SCHEME, start=0):
+    """ Number of rows, from the top, holding n_bytes written from slot start.
+        (int, int, Scheme, int) ~> (int)
+
+        >>> rows_touched(100, 10)
+        10
+    """
+    n_slots = start + n_bytes * slots_per_byte(scheme)
+    n_px = -(-n_slots // len(scheme.channels))
+    return -(-n_px // width)
+
+def linear_runs(n_slots, width, scheme=DEFAULT_SCHEME):
+    """ The runs of slots holding n_slots slots written row after row
+        from the top left pixel, as (row, first slot in the row, count).
+        (int, int, Scheme) ~> (List<Tuple<int, int, int>>)
+
+        >>> linear_runs(50, 10)
+        [(0, 0, 20), (1, 0, 20), (2, 0, 10)]
+    """
+    per_row = width * len(scheme.channels)
+    return [(y, 0, min(per_row, n_slots - y * per_row)) for y in range(-(-n_slots // per_row))]
+
+def region_runs(n_slots, rect, scheme=DEFAULT_SCHEME):
+    """ The runs of slots holding n_slots slots written row after row
+        in the rectangle rect (x, y, width, height, in pixels).
+        (int, Tuple<int>, Scheme) ~> (List<Tuple<int, int, int>>)
+
+        >>> region_runs(10, (2, 5, 3, 4))
+        [(5, 4, 6), (6, 4, 4)]
+    """
+    x, y, w, h = rect
+    nch = len(scheme.channels)
+    per_row = w * nch
+    n_rows = -(-n_slots // per_row)
+    if n_rows > h:
+        n = n_slots // slots_per_byte(scheme)
+        raise CapacityError(f"The data ({n} bytes) is too fat for the region {rect} "
+                            f"({per_row * h // slots_per_byte(scheme)} bytes)")
+    return [(y + k, x * nch, min(per_row, n_slots - k * per_row)) for k in range(n_rows)]
+
+def region_layout(data, rect, width, height, scheme=DEFAULT_SCHEME):
+    """ The runs of slots (see linear_runs) holding data in the
+        rectangle rect, and their pieces. The rectangle and the length
+        of data come first, in the REGION header written from the top
+        left pixel; the rectangle must be below its rows.
+        (bytes, Tuple<int>, int, int, Scheme) ~> (List<Tuple<int, int, int>>, bytearray)
+    """
+    check_region(rect, width, height, scheme)
+    header = split_pieces(REGION.pack(REGION_MAGIC, *rect, len(data)), scheme)
+    pieces = split_pieces(data, scheme)
+    runs = linear_runs(len(header), width, scheme) + region_runs(len(pieces), rect, scheme)
+    return runs, header + pieces
+
+def check_region(rect, width, height, scheme=DEFAULT_SCHEME):
+    x, y, w, h = rect
+    top = rows_touched(REGION.size, width, scheme)
+    if w <= 0 or h <= 0 or x < 0 or x + w > width or y < top or y + h > height:
+        raise ValueError(f"The region {rect} is not in the picture, below its first {top} rows")
+
+def row_texture(rows):
+    """ How textured each row of pixels is: the length of the row
+        compressed. Noisy rows compress badly, and hide the changes
+        of their low bits best.
+        (Iterable<bytes>) ~> (List<int>)
+    """
+    return [len(zlib.compress(row, 1)) for row in rows]
+
+def choose_region(texture, n_bytes, width, scheme=DEFAULT_SCHEME, interval=None):
+    """ A rectangle holding n_bytes in the fewest rows (the whole width
+        of the picture), where the rows are the most textured. texture
+        gives a score to each row (see row_texture). With restart points
+        every interval rows, only the places touching the fewest bands,
+        besides the ones of the REGION header, are considered.
+        (List<int>, int, int, Scheme, int) ~> (Tuple<int, int, int, int>)
+    """
+    height = len(texture)
+    top = rows_touched(REGION.size, width, scheme)
+    h = rows_touched(n_bytes, width, scheme)
+    if top + h > height:
+        raise CapacityError(f"The data ({n_bytes} bytes) is too fat for the image you have choosen")
+    starts = range(top, height - h + 1)
+    if interval:
+        header_bands = set(range(-(-top // interval)))
+
+        def cost(y):
+            return len(set(range(y // interval, (y + h - 1) // interval + 1)) - header_bands)
+
+        fewest = min(map(cost, starts))
+        starts = [y for y in starts if cost(y) == fewest]
+    # Sums of the scores of the windows of h rows
+    sums = list(itertools.accumulate(texture, initial=0))
+    y = max(starts, key=lambda y: sums[y + h] - sums[y])
+    return (0, y, width, h)
+
+def write_runs(pixels, width, top, runs, pieces, scheme=DEFAULT_SCHEME):
+    """ Write pieces in the runs of slots (see linear_runs) of the
+        pixels of the rows from top.
+        (bytearray|array, int, int, List<Tuple<int>>, bytes, Scheme) ~> (bytearray|array)
+    """
+    per_row = width * len(scheme.channels)
+    done = 0
+    for y, first, n in runs:
+        hide_pieces(pixels, pieces[done:done + n], scheme, (y - top) * per_row + first)
+        done += n
+    return pixels
+
+def read_runs(pixels, width, top, runs, scheme=DEFAULT_SCHEME):
+    """ Read the pieces of the runs of slots (see linear_runs) of the
+        pixels of the rows from top.
+        (bytearray|array, int, int, List<Tuple<int>>, Scheme) ~> (bytearray)
+    """
+    per_row = width * len(scheme.channels)
+    pieces = bytearray()
+    for y, first, n in runs:
+        pieces += find_pieces(pixels, n, scheme, (y - top) * per_row + first)
+    return pieces
+
+def find_region(src, scheme=DEFAULT_SCHEME, cache=None, stats=None):
+    """ Read the data written in a rectangle of the png file src (see
+        region_layout). Only the rows of the REGION header and of the
+        rectangle are decoded, when src has restart points and no cache
+        is given.
+        (str, Scheme, CarrierCache, png.Stats) ~> (bytes)
+    """
+    spb = slots_per_byte(scheme)
+    with open(src, "rb") as f:
+        r = png.Reader(file=f, stats=stats)
+        r.preamble()
+        if cache is None and r.restart_interval and r.color_type == 6 and r.bitdepth in (8, 16):
+            def rows(start, stop):
+                return r.read_rows(start, stop).buffer
+        else:
+            raster = load_raster(src, cache, stats=stats)
+
+            def rows(start, stop):
+                return raster.buffer[start * raster.vpr:stop * raster.vpr]
+
+        runs = linear_runs(REGION.size * spb, r.width, scheme)
+        header = join_pieces(read_runs(rows(0, len(runs)), r.width, 0, runs, scheme), scheme)
+        magic, *rect, n = REGION.unpack(header)
+        if magic != REGION_MAGIC:
+            raise CapacityError("No payload found: the picture has no region header")
+        try:
+            check_region(rect, r.width, r.height, scheme)
+            runs = region_runs(n * spb, rect, scheme)
+        except ValueError:
+            raise CapacityError("No payload found: the region header is out of the image")
+        if not runs:
+            return b""
+        top = runs[0][0]
+        with png.timer(stats, "extract"):
+            return join_pieces(read_runs(rows(top, runs[-1][0] + 1), r.width, top, runs, scheme), scheme)
+
+def write_raster(f, raster, restart_interval=RESTART_INTERVAL, stats=None, stored=False):
+    """ Encode a png.Raster of RGBA pixels as a png file,
+        its rows are compressed straight from its buffer.
+        When stored is True, they are not compressed, and data is
+        then hidden in the file in place (see patch_stored).
+        The encoding stages are recorded in stats, if given.
+    """
+    w = png.Writer(raster.width, raster.height, bitdepth=raster.bitdepth,
+                   greyscale=False, alpha=True, restart_interval=None if stored else restart_interval,
+                   stored=stored, stats=stats)
+    w.write_raster(f, raster)
+
+def write_rgba(f, width, height, pixels, restart_interval=RESTART_INTERVAL, stored=False):
+    """ Encode flat RGBA pixels as a png file,
+        with 16 bits per sample if the pixels are an array('H').
+    """
+    bitdepth = 16 if isinstance(pixels, array) else 8
+    write_raster(f, png.Raster(width, height, 4, bitdepth, pixels), restart_interval, stored=stored)
+
+def hide_in_png(src, dst, data, scheme=DEFAULT_SCHEME, cache=None, stats=None, pipeline=None,
+                region=None):
+    """ Write data in the pixels of the png file src, and save them in dst.
+        The data fills the rows from the top, or the rectangle region
+        (x, y, width, height) when it is given (see region_layout), or
+        a textured one chosen here when region is True.
+        When the image data of src is stored uncompressed (see
+        write_raster), the samples holding the data are patched in
+        place: in src when it is dst, or in a copy of src which then
+        replaces dst. Otherwise when src has restart points (the png
+        files written here have), only the bands of rows holding the
+        data are decoded and compressed again, the other ones are
+        copied as they are. Otherwise the whole picture is decoded and
+        encoded, streamed through threads when pipeline (the number of
+        rows each thread may run ahead) is given and no cache or region
+        is.
+        Return True when the partial re-encoding (or the patching) was
+        possible.
+        The time spent in each stage is recorded in stats, if given.
+        (str, str, bytes, Scheme, CarrierCache, png.Stats, int, Tuple<int>|bool) ~> (bool)
+    """
+    region = region or None
+    if is_stored(src):
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            patch_stored(dst, data, scheme, stats, region)
+            return True
+        import shutil
+
+        # A copy is patched, and replaces dst only once the data is in it
+        with replacing(dst, src) as tmp:
+            with png.timer(stats, "copy"):
+                shutil.copyfile(src, tmp)
+            patch_stored(tmp, data, scheme, stats, region)
+        return True
+    with open(src, "rb") as f:
+        parts = reencode_bands(f, data, scheme, stats, region)
+    if parts is None and pipeline and cache is None and region is None:
+        hide_pipelined(src, dst, data, scheme, pipeline, stats)
+        return False
+    if parts is None:
+        raster = load_raster(src, cache, stats=stats)
+        with png.timer(stats, "embed", bytes_in=len(data)):
+            if region is None:
+                hide_bytes(raster.buffer, data, scheme)
+            else:
+                if region is True:
+                    texture = row_texture(map(raster.row, range(raster.height)))
+                    region = choose_region(texture, len(data), raster.width, scheme)
+                runs, pieces = region_layout(data, region, raster.width, raster.height, scheme)
+                write_runs(raster.buffer, raster.width, 0, runs, pieces, scheme)
+        with open(dst, "wb") as f:
+            write_raster(f, raster, stats=stats)
+        return False
+    with png.timer(stats, "write"), open(dst, "wb") as f:
+        f.write(png.signature)
+        for part in parts:
+            f.write(part)
+    return True
+
+def is_stored(path):
+    """ Whether the png file path is an RGBA picture whose image data is
+        stored uncompressed (see write_raster), so that patch_stored
+        can write in it.
+        (str) ~> (bool)
+    """
+    with open(path, "rb") as f:
+        r = png.Reader(file=f)
+        r.preamble()
+    return bool(r.stored_block) and r.color_type == 6 and r.bitdepth in (8, 16)
+
+def patch_stored(path, data, scheme=DEFAULT_SCHEME, stats=None, region=None):
+    """ Write data in the pixels of the png file path in place: its image
+        data must be stored uncompressed (see is_stored), every sample
+        is then at a known offset of the file (see png.stored_offset).
+        The file is memory mapped, and only the bytes of the samples
+        holding the data are read and written, with the CRC-32 of their
+        IDAT chunks and the Adler-32 of the image data, which are
+        updated from the changed bytes only. The data fills the rows
+        from the top, or the rectangle region (see region_layout; True
+        chooses the rows below the REGION header).
+        (str, bytes, Scheme, png.Stats, Tuple<int>|bool) ~> (NoneType)
+    """
+    region = region or None
+    with open(path, "r+b") as f:
+        r = png.Reader(file=f)
+        r.preamble()
+        if not r.stored_block or r.color_type != 6 or r.bitdepth not in (8, 16):
+            raise png.FormatError(f"The image data of {path} is not stored uncompressed")
+        idat = f.tell() - 8
+        block = r.stored_block
+        rb = r.row_bytes
+        size = r.bitdepth // 8
+        stream = r.height * (rb + 1)
+        n_chunks = -(-stream // block)
+        nch = len(scheme.channels)
+
+        if region is None:
+            if rows_touched(len(data), r.width, scheme) > r.height:
+                raise CapacityError(f"The data ({len(data)} bytes) is too fat for the image you have choosen")
+            pieces = split_pieces(data, scheme)
+            runs = linear_runs(len(pieces), r.width, scheme)
+        else:
+            if region is True:
+                # Without decoding, nothing tells the textured rows apart
+                top = rows_touched(REGION.size, r.width, scheme)
+                region = (0, top, r.width, r.height - top)
+            runs, pieces = region_layout(data, region, r.width, r.height, scheme)
+
+        with mmap.mmap(f.fileno(), 0) as m:
+
+            def chunk(i):
+                # Offset of the data of chunk i, and its length
+                offset = png.stored_offset(idat, block, i * block) - 5 - (2 if i == 0 else 0)
+                length = min(block, stream - i * block) + 5 + (2 if i == 0 else 0) + (4 if i == n_chunks - 1 else 0)
+                if m[offset - 8:offset] != struct.pack("!I4s", length, b'IDAT'):
+                    raise png.FormatError("The IDAT chunks do not match the stLO chunk")
+                return offset, length
+
+            def patch(offset, new, i):
+                # Write new at offset, in the data of chunk i
+                start, length = chunk(i)
+                old = m[offset:offset + len(new)]
+                m[offset:offset + len(new)] = new
+                end = start + length
+                (crc,) = struct.unpack("!I", m[end:end + 4])
+                crc = png.crc32_replace(crc, zlib.crc32(old), zlib.crc32(new), end - offset - len(new))
+                m[end:end + 4] = struct.pack("!I", crc)
+                return old
+
+            last, last_length = chunk(n_chunks - 1)
+            (adler,) = struct.unpack("!I", m[last + last_length - 4:last + last_length])
+            done = 0
+            with png.timer(stats, "embed", bytes_in=len(data)):
+                for y, first, n in runs:
+                    # The samples of the pixels of the run, in the stream
+                    x0, x1 = first // nch, (first + n - 1) // nch + 1
+                    k0 = y * (rb + 1) + 1 + x0 * 4 * size
+                    k1 = k0 + (x1 - x0) * 4 * size
+                    if m[png.stored_offset(idat, block, y * (rb + 1))] != 0:
+                        raise png.FormatError(f"Row {y} is filtered")
+                    # The parts of the samples in each block
+                    parts = [(k, min(k1, (k // block + 1) * block)) for k in
+                             itertools.chain([k0], range((k0 // block + 1) * block, k1, block))]
+                    old = b"".join(m[png.stored_offset(idat, block, a):png.stored_offset(idat, block, b - 1) + 1]
+                                   for a, b in parts)
+                    samples = bytearray(old) if size == 1 else array("H", old)
+                    if size == 2 and sys.byteorder == "little":
+                        samples.byteswap()
+                    hide_pieces(samples, pieces[done:done + n], scheme, first - x0 * nch)
+                    done += n
+                    if size == 2 and sys.byteorder == "little":
+                        samples.byteswap()
+                    new = bytes(samples)
+                    for a, b in parts:
+                        segment = new[a - k0:b - k0]
+                        before = patch(png.stored_offset(idat, block, a), segment, a // block)
+                        adler = png.adler32_replace(adler, zlib.adler32(before), zlib.adler32(segment), stream - b)
+            patch(last + last_length - 4, struct.pack("!I", adler), n_chunks - 1)
+
+def hide_pipelined(src, dst, data, scheme=DEFAULT_SCHEME, maxsize=8, stats=None):
+    """ Write data in the pixels of the png file src, and save them in dst,
+        streaming the rows through three threads linked by queues of
+        maxsize rows (see hide_stream). The picture is written to a
+        temporary file, which replaces dst once it is complete (see
+        replacing), so src can be dst.
+        (str, str, bytes, Scheme, int, png.Stats) ~> (NoneType)
+    """
+    # Checked before anything is written, from the header of src only
+    if capacity(src, scheme, framed=False) < len(data):
+        raise CapacityError(f"The data ({len(data)} bytes) is too fat for the image you have choosen")
+    with replacing(dst, src) as tmp, open(src, "rb") as fin, open(tmp, "wb") as fout:
+        hide_stream(fin, fout, data, scheme, maxsize, stats)
+
+def hide_stream(src, dst, data, scheme=DEFAULT_SCHEME, maxsize=None, stats=None):
+    """ Write data in the pixels of the png read from the binary file
+        src, and write the picture in the binary file dst. The rows are
+        streamed from one file to the other, so the picture is never
+        held whole and neither file needs to seek (pipes work).
+        With maxsize, the rows go through three threads linked by
+        queues of maxsize rows: reading, inflating, unfiltering and
+        converting the rows on the first one, writing the data in them
+        on the second one, and filtering, deflating and writing them
+        on this one.
+        (BinaryIO, BinaryIO, bytes, Scheme, int, png.Stats) ~> (NoneType)
+    """
+    r = png.Reader(file=src, stats=stats)
+    r.preamble()
+    if capacity_bytes(r.width, r.height, scheme, framed=False) < len(data):
+        raise CapacityError(f"The data ({len(data)} bytes) is too fat for the image you have choosen")
+    width, height, rows, info = read_rgba_rows(r)
+    if maxsize:
+        # The time spent waiting for the previous thread is its own stage
+        rows = png.instrument(stats, "wait", threaded(rows, maxsize))
+    rows = hide_rows(rows, data, scheme, "BH"[info["bitdepth"] > 8])
+    rows = png.instrument(stats, "embed", rows)
+    if maxsize:
+        rows = png.instrument(stats, "wait", threaded(rows, maxsize))
+    w = png.Writer(width, height, bitdepth=info["bitdepth"], greyscale=False, alpha=True,
+                   restart_interval=RESTART_INTERVAL, stats=stats)
+    w.write(dst, rows)
+
+def read_rgba_rows(r):
+    """ The rows of RGBA pixels of a png.Reader, as they are decoded,
+        with the values of load_raster.
+        (png.Reader) ~> (int, int, Iterator<array>, dict)
+    """
+    r.preamble()
+    if r.bitdepth == 16:
+        return r.asRGBA(sbit=False)
+    return r.asRGBA8(sbit=False)
+
+def find_rows(rows, scheme=DEFAULT_SCHEME, framed=True):
+    """ Read the data written in the rows of RGBA pixels from the top:
+        a framed payload, or all the bytes the rows can hold. The rows
+        are only read until the end of the payload.
+        (Iterable<Sequence<int>>, Scheme, bool) ~> (bytes)
+    """
+    finder = RowFinder(scheme, framed)
+    for row in rows:
+        if finder.add(row):
+            break
+    return finder.result()
+
+
+class RowFinder:
+    """ Read the data written in rows of RGBA pixels from the top, the
+        rows being given one at a time (see find_rows).
+    """
+
+    def __init__(self, scheme=DEFAULT_SCHEME, framed=True):
+        self.scheme = scheme
+        self.framed = framed
+        self.header = HEADER.size * slots_per_byte(scheme)
+        # Number of pieces to read, once the length header is read
+        self.needed = self.header if framed else None
+        self.pieces = bytearray()
+
+    def add(self, row):
+        """ Read the pieces of a row, return True once the payload is
+            complete.
+            (Sequence<int>) ~> (bool)
+        """
+        if not isinstance(row, bytearray) and not (isinstance(row, array) and row.typecode == "H"):
+            row = bytearray(row)
+        scheme, pieces = self.scheme, self.pieces
+        per_row = len(row) // 4 * len(scheme.channels)
+        done = 0
+        while done < per_row and (self.needed is None or len(pieces) < self.needed):
+            n = per_row - done if self.needed is None else min(per_row - done, self.needed - len(pieces))
+            pieces += find_pieces(row, n, scheme, done)
+            done += n
+            if self.needed == self.header and len(pieces) == self.header:
+                (length,) = HEADER.unpack(join_pieces(pieces, scheme))
+                self.needed += length * slots_per_byte(scheme)
+        return self.needed is not None and len(pieces) >= self.needed
+
+    def result(self):
+        """ The data read.
+            () ~> (bytes)
+        """
+        pieces = self.pieces
+        if not self.framed:
+            return join_pieces(pieces[:len(pieces) - len(pieces) % slots_per_byte(self.scheme)], self.scheme)
+        if len(pieces) < self.needed:
+            raise CapacityError("No payload found: the length header is out of the image")
+        return join_pieces(pieces[self.header:], self.scheme)
+
+
+class RowDecoder:
+    """ Incremental decoding of the rows of a non interlaced png, whose
+        preamble was read by the png.Reader r: the IDAT data goes in as
+        it comes, the rows it completes come out.
+    """
+
+    def __init__(self, r):
+        self.r = r
+        self.inflate = zlib.decompressobj()
+        self.pending = bytearray()
+        self.previous = None
+        self.rows = 0
+
+    def feed(self, data):
+        """ Inflate and unfilter IDAT data, return the values of the
+            rows it completes (as png.Reader.read_rows would).
+            (bytes) ~> (png.Raster)
+        """
+        r = self.r
+        self.pending += self.inflate.decompress(data)
+        size = r.row_bytes + 1
+        n = len(self.pending) // size
+        values = png.Raster(r.width, n, r.planes, r.bitdepth)
+        if n:
+            with memoryview(self.pending) as view, memoryview(values.buffer) as out, out.cast('B') as dest:
+                self.previous = r._unfilter_into([view[:n * size]], dest, self.previous)
+            del self.pending[:n * size]
+            if r.bitdepth > 8 and sys.byteorder == "little":
+                # PNG is big-endian
+                values.buffer.byteswap()
+        self.rows += n
+        return values
+
+
+class RowEmbedder:
+    """ Incremental embedding of data in the rows of a non interlaced RGBA
+        png, whose preamble was read by the png.Reader r: its IDAT data
+        goes in as it comes, the IDAT data of the new picture comes out,
+        one chunk per band of RESTART_INTERVAL rows (see png.Writer).
+        Each call only does the work of the data it is given, so an event
+        loop can hand it to an executor between two reads.
+    """
+
+    def __init__(self, r, data, scheme=DEFAULT_SCHEME):
+        self.decoder = RowDecoder(r)
+        self.scheme = scheme
+        self.pieces = split_pieces(data, scheme)
+        self.done = 0
+        self.deflate = zlib.compressobj()
+        self.band = bytearray()
+        self.band_rows = 0
+
+    def feed(self, data):
+        """ Write the data in the rows completed by the IDAT data, and
+            return the IDAT chunks of the bands they complete.
+            (bytes) ~> (List<bytes>)
+        """
+        values = self.decoder.feed(data)
+        r = self.decoder.r
+        buffer = values.buffer
+        if self.done < len(self.pieces):
+            n = min(values.height * r.width * len(self.scheme.channels), len(self.pieces) - self.done)
+            hide_pieces(buffer, self.pieces[self.done:self.done + n], self.scheme)
+            self.done += n
+        if r.bitdepth > 8 and sys.byteorder == "little":
+            buffer.byteswap()
+        chunks = []
+        rb = r.row_bytes
+        with memoryview(buffer) as view, view.cast('B') as row_bytes:
+            for y in range(values.height):
+                self.band.append(0)
+                self.band += row_bytes[y * rb:(y + 1) * rb]
+                self.band_rows += 1
+                last = self.decoder.rows - values.height + y + 1 >= r.height
+                if self.band_rows == RESTART_INTERVAL and not last:
+                    chunks.append(self.deflate.compress(self.band) + self.deflate.flush(zlib.Z_FULL_FLUSH))
+                    self.band = bytearray()
+                    self.band_rows = 0
+        return chunks
+
+    def finish(self):
+        """ Return the last IDAT chunk, once all the rows were given.
+            () ~> (bytes)
+        """
+        r = self.decoder.r
+        if self.decoder.rows != r.height:
+            raise png.FormatError(f"The image data ends after {self.decoder.rows} rows of {r.height}")
+        if self.done < len(self.pieces):
+            n = len(self.pieces) // slots_per_byte(self.scheme)
+            raise CapacityError(f"The data ({n} bytes) is too fat for the image you have choosen")
+        return self.deflate.compress(self.band) + self.deflate.flush()
+
+
+def open_file(f, mode="rb"):
+    """ A context opening the path f, or giving back the file f as it is
+        (it is not closed then).
+        (str|BinaryIO, str) ~> (ContextManager<BinaryIO>)
+    """
+    if isinstance(f, str):
+        return open(f, mode)
+    return contextlib.nullcontext(f)
+
+@contextlib.contextmanager
+def replacing(path, like=None):
+    """ A context giving a temporary file next to path, which replaces
+        path once the context exits without error, and is removed
+        otherwise: path is never left half written, and can be the file
+        being read. The file keeps the permissions of path, or takes the
+        ones of the file like when path does not exist yet.
+        (str, str) ~> (ContextManager<str>)
+    """
+    import shutil
+    import tempfile
+
+    fd, tmp = tempfile.mkstemp(suffix=".png", dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    try:
+        yield tmp
+        if os.path.exists(path) or like is not None:
+            shutil.copymode(path if os.path.exists(path) else like, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def reencode_bands(f, data, scheme=DEFAULT_SCHEME, stats=None, region=None):
+    """ Write data in the bands of rows of the png file f holding it,
+        and return the parts of the new file (all its bytes but the
+        signature). The data fills the rows from the top, or the
+        rectangle region (see region_layout; True chooses it from the
+        compressed size of the bands, the most textured ones compress
+        the least).
+        Return None when f has no usable restart points, or when the
+        data spreads over all of them.
+        (BinaryIO, bytes, Scheme, png.Stats, Tuple<int>|bool) ~> (List<bytes>)
+    """
+    region = region or None
+    r = png.Reader(file=f)
+    r.preamble()
+    if not r.restart_interval or r.color_type != 6 or r.bitdepth not in (8, 16):
+        return None
+    interval = r.restart_interval
+    n_bands = -(-r.height // interval)
+    if region is None and rows_touched(len(data), r.width, scheme) > r.height:
+        raise CapacityError(f"The data ({len(data)} bytes) is too fat for the image you have choosen")
+
+    # Chunks before the first IDAT are copied as they are
+    idat_offset = f.tell() - 8
+    f.seek(len(png.signature))
+    before = f.read(idat_offset - len(png.signature))
+    f.seek(idat_offset + 8)
+    bands, after = [], []
+    for type, chunk in r.chunks():
+        if type == b'IDAT' and not after:
+            bands.append(chunk)
+        else:
+            after.append((type, chunk))
+    if len(bands) != n_bands:
+        # The IDAT chunks were split or merged since they were written
+        return None
+
+    if region is None:
+        pieces = split_pieces(data, scheme)
+        runs = linear_runs(len(pieces), r.width, scheme)
+    else:
+        if region is True:
+            texture = [len(bands[y // interval]) // min(interval, r.height - y // interval * interval)
+                       for y in range(r.height)]
+            region = choose_region(texture, len(data), r.width, scheme, interval)
+        runs, pieces = region_layout(data, region, r.width, r.height, scheme)
+    touched = sorted({y // interval for y, _, _ in runs})
+    if len(touched) >= n_bands:
+        return None
+
+    # Decode the touched bands: as they start and end on a full flush
+    # point, each one is inflated on its own (as raw deflate data but
+    # the first one), and their rows do not refer to the ones above.
+    rb = r.row_bytes
+    raws = {}
+    with png.timer(stats, "inflate") as counts:
+        for b in touched:
+            d = zlib.decompressobj() if b == 0 else zlib.decompressobj(-zlib.MAX_WBITS)
+            raws[b] = d.decompress(bands[b])
+            n_rows = min(interval, r.height - b * interval)
+            if len(raws[b]) != n_rows * (rb + 1):
+                raise png.FormatError("Restart points do not match the rows of the image.")
+            if raws[b][0] not in (0, 1):
+                return None
+        # The first row of a band left as it is must not refer to the
+        # last row of a touched band above it (filters Up, Average and
+        # Paeth do): only its filter type byte is inflated
+        for b in touched:
+            if b + 1 < n_bands and b + 1 not in raws:
+                first = zlib.decompressobj(-zlib.MAX_WBITS).decompress(bands[b + 1], 1)
+                if first[:1] not in (b"\x00", b"\x01"):
+                    return None
+        if stats:
+            counts.update(bytes_in=sum(len(bands[b]) for b in touched),
+                          bytes_out=sum(map(len, raws.values())))
+    values = {}
+    with png.timer(stats, "unfilter", bytes_in=sum(map(len, raws.values()))):
+        for b, raw in raws.items():
+            values[b] = png.Raster(r.width, len(raw) // (rb + 1), 4, r.bitdepth)
+            with memoryview(values[b].buffer) as view, view.cast('B') as dest:
+                r._unfilter_into([raw], dest)
+            if r.bitdepth == 16 and sys.byteorder == "little":
+                values[b].buffer.byteswap()
+
+    with png.timer(stats, "embed", bytes_in=len(data)):
+        done = 0
+        for run in runs:
+            b = run[0] // interval
+            write_runs(values[b].buffer, r.width, b * interval, [run], pieces[done:done + run[2]], scheme)
+            done += run[2]
+
+    # Compress the touched bands again, with the same layout. The last
+    # band ends with the Adler-32 of all the rows: swap the
+    # contribution of each old band for the one of the new band.
+    (total,) = struct.unpack("!I", bands[-1][-4:])
+    new_bands = {}
+    with png.timer(stats, "deflate") as counts:
+        for b in touched:
+            buffer = values[b].buffer
+            if r.bitdepth == 16 and sys.byteorder == "little":
+                # PNG is big-endian
+                buffer.byteswap()
+            band = bytearray()
+            with memoryview(buffer) as view, view.cast('B') as row_bytes:
+                for y in range(values[b].height):
+                    band.append(0)
+                    band += row_bytes[y * rb:(y + 1) * rb]
+            n_after = (r.height - b * interval - values[b].height) * (rb + 1)
+            total = png.adler32_replace(total, zlib.adler32(raws[b]), zlib.adler32(band), n_after)
+            compressor = zlib.compressobj() if b == 0 else zlib.compressobj(wbits=-zlib.MAX_WBITS)
+            last = b == n_bands - 1
+            new_bands[b] = compressor.compress(band) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH)
+        if stats:
+            counts.update(bytes_in=sum(map(len, raws.values())), bytes_out=sum(map(len, new_bands.values())),
+                          rows=sum(values[b].height for b in touched))
+    bands = [new_bands.get(b, band) for b, band in enumerate(bands)]
+    if n_bands - 1 not in new_bands:
+        bands[-1] = bands[-1][:-4]
+    bands[-1] += struct.pack("!I", total)
+
+    parts = [before]
+    for type, chunk in [(b'IDAT', band) for band in bands] + after:
+        out = io.BytesIO()
+        png.write_chunk(out, type, chunk)
+        parts.append(out.getvalue())
+    return parts
+
+def embed(src, dst, payload, key=None, channels="RG", bits=4, framed=True, cache=None, stats=None,
+          pipeline=None, region=None):
+    """ Hide payload in the png file src, and save the picture in dst.
+        The payload is framed by its length, unless framed is False;
+        with a key it is sealed too (and must be framed).
+        With a region (a rectangle, or True to choose one, see
+        hide_in_png; None or False for none) the payload is written in
+        it, and framed by the REGION header instead.
+        src and dst are paths, or binary files: the rows are then
+        streamed from one to the other (see hide_stream), which works
+        with pipes but not with a region.
+        Return True when only the bands of rows holding it were encoded
+        again (see hide_in_png, for pipeline too).
+        (str|BinaryIO, str|BinaryIO, bytes, str|bytes, str, int, bool, CarrierCache, png.Stats, int,
+         Tuple<int>|bool) ~> (bool)
+    """
+    if key is not None and not framed:
+        raise ValueError("A sealed payload must be framed")
+    region = region or None
+    streamed = not isinstance(src, str) or not isinstance(dst, str)
+    if streamed and region is not None:
+        raise ValueError("A payload in a region needs png files, not streams")
+    scheme = make_scheme(channels, bits)
+    if region is not None:
+        if key is not None:
+            import cipher
+            with png.timer(stats, "seal", bytes_in=len(payload)):
+                payload = cipher.seal(key, payload)
+    elif framed:
+        with png.timer(stats, "seal", bytes_in=len(payload)):
+            payload = pack_payload(payload, key)
+    if streamed:
+        with open_file(src, "rb") as fin, open_file(dst, "wb") as fout:
+            hide_stream(fin, fout, payload, scheme, pipeline, stats)
+        return False
+    return hide_in_png(src, dst, payload, scheme, cache, stats, pipeline, region)
+
+def extract(src, key=None, channels="RG", bits=4, framed=True, cache=None, stats=None, region=None,
+            workers=1):
+    """ Read the payload hidden in the png file src (see embed).
+        When framed is False, all the bytes the picture can hold are
+        returned. When region is True, the payload is read from the
+        rectangle its REGION header tells (see find_region).
+        src is a path, or a binary file whose rows are only read
+        until the end of the payload (see find_rows). A path is decoded
+        with workers threads (see load_raster).
+        (str|BinaryIO, str|bytes, str, int, bool, CarrierCache, png.Stats, bool, int) ~> (bytes)
+    """
+    if key is not None and not framed:
+        raise ValueError("A sealed payload must be framed")
+    scheme = make_scheme(channels, bits)
+    if not isinstance(src, str):
+        if region:
+            raise ValueError("A payload in a region needs a png file, not a stream")
+        rows = read_rgba_rows(png.Reader(file=src, stats=stats))[2]
+        with png.timer(stats, "extract"):
+            data = find_rows(rows, scheme, framed)
+    elif region:
+        data = find_region(src, scheme, cache, stats)
+    else:
+        raster = load_raster(src, cache, stats=stats, workers=workers)
+        with png.timer(stats, "extract"):
+            if framed:
+                return find_payload(raster.buffer, key, scheme)
+            n = capacity_bytes(raster.width, raster.height, scheme, framed=False)
+            return find_bytes(raster.buffer, n, scheme)
+    if key is not None:
+        import cipher
+        data = cipher.unseal(key, data)
+    return data
+
+class StreamBridge(io.RawIOBase):
+    """ A blocking binary file over asyncio streams, for code running in
+        an executor while the loop runs the streams: it reads the bytes
+        head (already read from reader), then the asyncio.StreamReader
+        reader; it writes to the asyncio.StreamWriter writer, drained
+        after each write. Only one read or write is pending at a time,
+        so the bytes are streamed and never held whole.
+    """
+
+    def __init__(self, loop, reader=None, writer=None, head=b""):
+        super().__init__()
+        self.loop = loop
+        self.reader = reader
+        self.writer = writer
+        self.head = bytearray(head)
+
+    def readable(self):
+        return self.reader is not None
+
+    def writable(self):
+        return self.writer is not None
+
+    def run(self, coroutine):
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def readinto(self, b):
+        if self.head:
+            data = self.head[:len(b)]
+            del self.head[:len(data)]
+        else:
+            data = self.run(self.reader.read(len(b)))
+        b[:len(data)] = data
+        return len(data)
+
+    def write(self, b):
+        data = bytes(b)
+
+        async def write():
+            self.writer.write(data)
+            await self.writer.drain()
+
+        self.run(write())
+        return len(data)
+
+async def read_chunk_header(reader):
+    """ Read the length and the type of the next chunk from the
+        asyncio.StreamReader reader.
+        (asyncio.StreamReader) ~> (int, bytes)
+    """
+    return struct.unpack("!I4s", await reader.readexactly(8))
+
+async def read_chunk_data(reader, length):
+    """ Read the data of a chunk, and its checksum, from the
+        asyncio.StreamReader reader.
+        (asyncio.StreamReader, int) ~> (bytes, bytes)
+    """
+    data = await reader.readexactly(length + 4)
+    return data[:-4], data[-4:]
+
+def check_chunk(type, data, checksum):
+    """ Raise png.ChunkError unless checksum is the one of the chunk. """
+    if struct.pack("!I", zlib.crc32(data, zlib.crc32(type))) != checksum:
+        raise png.ChunkError(f"Checksum error in {type.decode('ascii')} chunk.")
+
+async def read_preamble(reader):
+    """ Read a png from the asyncio.StreamReader reader, up to its first
+        IDAT chunk. Return a png.Reader that read the chunks before it
+        (see png.Reader.preamble), all the bytes read, and the length of
+        the first IDAT chunk.
+        (asyncio.StreamReader) ~> (png.Reader, bytearray, int)
+    """
+    head = bytearray(await reader.readexactly(len(png.signature)))
+    while True:
+        length, type = await read_chunk_header(reader)
+        head += struct.pack("!I4s", length, type)
+        if type == b'IDAT':
+            break
+        head += await reader.readexactly(length + 4)
+    r = png.Reader(bytes=head)
+    r.preamble()
+    return r, head, length
+
+async def embed_async(reader, writer, payload, key=None, channels="RG", bits=4, framed=True, executor=None):
+    """ Hide payload in the png read from the asyncio.StreamReader reader,
+        and write the picture to the asyncio.StreamWriter writer (see
+        embed). The IDAT chunks are handled one at a time: inflating,
+        unfiltering, embedding and deflating them (see RowEmbedder), and
+        sealing the payload, are done in the executor (the default one
+        of the loop if None), and the writer is drained after each one,
+        so the loop stays free for the other requests. Pictures that
+        are not non interlaced RGBA are streamed through hide_stream in
+        the executor instead (see StreamBridge), which holds a thread of
+        the executor for the whole picture.
+        (asyncio.StreamReader, asyncio.StreamWriter, bytes, str|bytes, str, int, bool,
+         concurrent.futures.Executor) ~> (NoneType)
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    if key is not None and not framed:
+        raise ValueError("A sealed payload must be framed")
+    scheme = make_scheme(channels, bits)
+    if framed:
+        payload = await loop.run_in_executor(executor, pack_payload, payload, key)
+    r, head, length = await read_preamble(reader)
+
+    if r.color_type != 6 or r.bitdepth not in (8, 16) or r.interlace:
+        src = StreamBridge(loop, reader=reader, head=head)
+        dst = StreamBridge(loop, writer=writer)
+        await loop.run_in_executor(executor, hide_stream, src, dst, payload, scheme)
+        return
+
+    if capacity_bytes(r.width, r.height, scheme, framed=False) < len(payload):
+        raise CapacityError(f"The data ({len(payload)} bytes) is too fat for the image you have choosen")
+    embedder = RowEmbedder(r, payload, scheme)
+
+    def step(data, checksum):
+        check_chunk(b'IDAT', data, checksum)
+        return embedder.feed(data)
+
+    preamble = io.BytesIO()
+    png.Writer(r.width, r.height, bitdepth=r.bitdepth, greyscale=False, alpha=True,
+               restart_interval=RESTART_INTERVAL).write_preamble(preamble)
+    writer.write(preamble.getvalue())
+    type = b'IDAT'
+    while type != b'IEND':
+        data, checksum = await read_chunk_data(reader, length)
+        if type == b'IDAT':
+            for chunk in await loop.run_in_executor(executor, step, data, checksum):
+                png.write_chunk(writer, b'IDAT', chunk)
+            await writer.drain()
+        # The chunks after the image data are dropped, like png.Writer does
+        length, type = await read_chunk_header(reader)
+    await reader.readexactly(length + 4)
+    png.write_chunk(writer, b'IDAT', await loop.run_in_executor(executor, embedder.finish))
+    png.write_chunk(writer, b'IEND')
+    await writer.drain()
+
+async def extract_async(reader, key=None, channels="RG", bits=4, framed=True, executor=None):
+    """ Read the payload hidden in the png read from the
+        asyncio.StreamReader reader (see extract). The IDAT chunks are
+        decoded one at a time in the executor (the default one of the
+        loop if None), and only until the end of the payload; unsealing
+        it is done there too. Pictures that are not non interlaced RGBA
+        are streamed to find_rows in the executor (see StreamBridge).
+        (asyncio.StreamReader, str|bytes, str, int, bool, concurrent.futures.Executor) ~> (bytes)
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    if key is not None and not framed:
+        raise ValueError("A sealed payload must be framed")
+    scheme = make_scheme(channels, bits)
+    r, head, length = await read_preamble(reader)
+
+    if r.color_type != 6 or r.bitdepth not in (8, 16) or r.interlace:
+        src = StreamBridge(loop, reader=reader, head=head)
+
+        def find():
+            return find_rows(read_rgba_rows(png.Reader(file=src))[2], scheme, framed)
+
+        data = await loop.run_in_executor(executor, find)
+    else:
+        decoder = RowDecoder(r)
+        finder = RowFinder(scheme, framed)
+
+        def step(data, checksum):
+            check_chunk(b'IDAT', data, checksum)
+            values = decoder.feed(data)
+            return any(finder.add(values.buffer[y * values.vpr:(y + 1) * values.vpr])
+                       for y in range(values.height))
+
+        type = b'IDAT'
+        while type == b'IDAT':
+            data, checksum = await read_chunk_data(reader, length)
+            if await loop.run_in_executor(executor, step, data, checksum):
+                break
+            length, type = await read_chunk_header(reader)
+        data = finder.result()
+    if key is not None:
+        import cipher
+        data = await loop.run_in_executor(executor, cipher.unseal, key, data)
+    return data
@@ -3,127 +3,165 @@
 
 """ main.py: Read or write a message in a png file using LSB method
 
-usage: main.py [-h] -f FILENAME -o OUTPUT [-t TEXT] [-m {write,read}]
+usage: main.py [-h] -f FILENAME [-o OUTPUT] [-t TEXT] [-k KEY] [-c CHANNELS]
+               [-b {1,2,4,8}] [-m {write,read}] [--capacity] [--stats]
+               [--pipeline] [-r [X,Y,W,H]]
 optional arguments:
   -h, --help            show this help message and exit
   -f FILENAME, --filename FILENAME
-                        The filename to use
+                        The filename to use, - for the standard input
+  -o OUTPUT, --output OUTPUT
+                        The png file written in write mode, - for the
+                        standard output (default: hidden.png)
   -t TEXT, --text TEXT  The top secret text to be sent
+  -k KEY, --key KEY     Encrypt and authenticate the text with this passphrase
+  -c CHANNELS, --channels CHANNELS
+                        The RGBA channels holding the message (default: RG)
+  -b {1,2,4,8}, --bits {1,2,4,8}
+                        The number of LSB replaced in each channel (default: 4)
   -m {write,read}, --mode {write,read}
                         Read to read a msg from a png, wrtie to write a msg in a png
+  --capacity            Print how many bytes can be hidden in the png, then exit
+  --stats               Print the time and bytes of each stage as JSON on stderr
+  --pipeline            Decode, embed and encode the picture on separate threads
+  -r [X,Y,W,H], --region [X,Y,W,H]
+                        Hide the text in this rectangle of pixels, or in a
+                        textured one when none is given (read mode: read it
+                        from the rectangle it was hidden in)
 
 Author : Vincent Brignatz
 """
 
 
-import png
+import re
+import sys
+import json
 import argparse
-import subprocess
-
-parser = argparse.ArgumentParser(description='Read or write a message in a png file using LSB method')
-parser.add_argument('-f', "--filename", type=str, required=True,
-                    help='The filename to use')
-parser.add_argument('-t', "--text", type=str, default=None,
-                    help='The top secret text to be sent')
-parser.add_argument('-m', "--mode", type=str, choices=["write", "read"], default="write",
-                    help="Read to read a msg from a png, wrtie to write a msg in a png")
-
-args = parser.parse_args()
-
-def split_number(n):
-    """ Split a byte into two 4 bits parts 
-        (int) ~> (int, int)
-
-        >>> split_number(0b10100101)
-        (0b1010, 0b0101)
-    """
-    if n > 0b11111111:
-        raise AttributeError("The number given is not a Byte")
-    h_part = (n & 0b11110000) >> 4
-    l_part =  n & 0b1111
-    return h_part, l_part
-
-def concat_number(h_part, l_part):
-    """ Concatenate two 4 bits numbers into a byte.
-        (int, int) ~> (int)
-
-        >>> concat_number(0b1010, 0b0101)
-        0b10100101
-    """
-    if h_part > 0b1111 or l_part > 0b1111:
-        raise AttributeError("The parts given is not a 4 bits digits")
-    return (h_part << 4) + l_part
-
-def replace_lsb(number, bits):
-    """ Replace the 4 LSB by 4 bits
-        (int, int) ~> (int)
-
-        >>> replace_lsb(0b10100101, 0b1100)
-        0b10101100
-    """
-    return (number & 0b11110000) + bits
 
-def hide_message(rgba_img, message):
-    """ Write the lsb from R and G channel of the picture to hide the message.
-        (List<List<Tuple<int>>>, str) ~> (List<List<Tuple<int>>>)
+import lsb
+import png
 
-        >>> hide_message([[1, 2, 3, 0, 4, 5, 6, 0], [1, 2, 3, 0, 7, 8, 9, 0]], "abc")
-        [[6, 1, 3, 0, 6, 2, 6, 0], [6, 3, 3, 0, 7, 8, 9, 0]]
+def make_parser():
+    parser = argparse.ArgumentParser(description='Read or write a message in a png file using LSB method')
+    parser.add_argument('-f', "--filename", type=str, required=True,
+                        help='The filename to use, - for the standard input')
+    parser.add_argument('-o', "--output", type=str, default="hidden.png",
+                        help='The png file written in write mode, - for the standard output (default: hidden.png)')
+    parser.add_argument('-t', "--text", type=str, default=None,
+                        help='The top secret text to be sent')
+    parser.add_argument('-k', "--key", type=str, default=None,
+                        help='Encrypt and authenticate the text with this passphrase')
+    parser.add_argument('-c', "--channels", type=str, default="RG",
+                        help='The RGBA channels holding the message (default: RG)')
+    parser.add_argument('-b', "--bits", type=int, choices=[1, 2, 4, 8], default=4,
+                        help='The number of LSB replaced in each channel (default: 4)')
+    parser.add_argument('-m', "--mode", type=str, choices=["write", "read"], default="write",
+                        help="Read to read a msg from a png, wrtie to write a msg in a png")
+    parser.add_argument("--capacity", action="store_true",
+                        help="Print how many bytes can be hidden in the png, then exit")
+    parser.add_argument("--stats", action="store_true",
+                        help="Print the time and bytes of each stage as JSON on stderr")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Decode, embed and encode the picture on separate threads")
+    parser.add_argument('-r', "--region", type=parse_region, nargs="?", const=True, default=None,
+                        metavar="X,Y,W,H",
+                        help="Hide the text in this rectangle of pixels, or in a textured one when none "
+                             "is given (read mode: read it from the rectangle it was hidden in)")
+    return parser
+
+def parse_region(text):
+    """ Parse a rectangle of pixels given as X,Y,W,H.
+        (str) ~> (Tuple<int>)
+
+        >>> parse_region("0,8,100,4")
+        (0, 8, 100, 4)
     """
-    width = int(len(rgba_img[0]) / 4)
-    for k, char in enumerate(message):
-        h, l = split_number(ord(char))
-        i, j = k%width, int(k/width)
-        rgba_img[j][i*4]   = replace_lsb(rgba_img[j][i*4], h)
-        rgba_img[j][i*4+1] = replace_lsb(rgba_img[j][i*4+1], l)
-    return rgba_img
-
-def find_message(rgba_img):
-    """ Read the lsb from R and G channel, contatenate them to find the message hidden in the picture.
-        (List<List<Tuple<int>>>) ~> (str)
-
-        >>> find_message([[6, 1, 3, 0, 6, 2, 6, 0], [6, 3, 3, 0, 7, 8, 9, 0]])
-        "abcx"
+    try:
+        x, y, w, h = map(int, text.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{text}' is not a rectangle X,Y,W,H")
+    return x, y, w, h
+
+def first_string(data, min_len=4):
+    """ First run of at least min_len printable characters in data
+        decoded as UTF-8, like the first line printed by the strings
+        command (the bytes that are not UTF-8 end a run).
+        (bytes, int) ~> (str)
+
+        >>> first_string(b"\\x01\\x02abcdef\\x00xyz")
+        'abcdef'
+        >>> first_string("\\x01h\\xe9llo w\\xf6rld\\x00".encode("utf-8") + b"\\xff")
+        'héllo wörld'
     """
-    msg = ""
-    for row in rgba_img:
-        for i in range(0, len(rgba_img[0])-3, 4):
-            _, h = split_number(row[i])
-            _, l = split_number(row[i+1])
-            msg += chr(concat_number(h, l))
-    return msg
-
-if __name__ == "__main__":
-    # Read the image
-    r=png.Reader(filename=args.filename)
-    width, height, rows, infos = r.asRGBA8()
-    rgba_img = [list(r) for r in rows]
+    text = data.decode("utf-8", errors="replace")
+    match = re.search(r"[^\x00-\x08\x0a-\x1f\x7f-\x9f\ufffd]{%d,}" % min_len, text)
+    return match.group() if match else ""
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    scheme = lsb.make_scheme(args.channels, args.bits)
+    sealed = args.key is not None
+    # Only recorded when asked for, the pipeline is not slowed down otherwise
+    stats = png.Stats() if args.stats else None
+
+    # With -, the picture streams through the standard input and output,
+    # and the messages go to the standard error
+    src = png.binary_stdin() if args.filename == "-" else args.filename
+    dst = png.binary_stdout() if args.output == "-" else args.output
+    log = sys.stderr if args.output == "-" else sys.stdout
+    if args.region is not None and "-" in (args.filename, args.output):
+        parser.error("argument -r/--region: the picture must be a file, not -")
+
+    if args.capacity:
+        # Only the header of the png is read
+        print(lsb.capacity(src, scheme, sealed=sealed, framed=sealed))
+        return
 
     if args.mode == "write":
         # Check we have a message
         if args.text is None:
             parser.print_help()
             print("main.py: error: the following arguments are required when in writing mode: -t/--text")
-            exit(0)
-
-        print(f"Hiding '{args.text}' in hidden.png from image {args.filename}")
-
-        # sanity check
-        n_px = width * height
-        n_msg = len(args.text)
-        if n_px < n_msg:
-            raise MemoryError(f"The text ({n_msg} chars) is too fat for the image you have choosen ({n_px} pixels)")
-
-        # hide the message
-        new_rgba_img = hide_message(rgba_img, args.text)
-
-        # save new image in hidden.png 
-        w = png.Writer(width, height, bitdepth=8, greyscale=False, alpha=True)
-        f = open("hidden.png", 'wb')
-        w.write(f, new_rgba_img)
+            return
+
+        # the text is hidden as UTF-8, a sealed message is framed by its length
+        data = args.text.encode("utf-8")
+
+        # sanity check, before decoding the image
+        # (a picture read from the standard input is checked once its header is read)
+        n_msg = len(data)
+        if args.filename != "-":
+            n_cap = lsb.capacity(args.filename, scheme, sealed=sealed, framed=sealed)
+            if n_cap < n_msg:
+                raise MemoryError(f"The text ({n_msg} bytes) is too fat for the image you have choosen ({n_cap} bytes)")
+
+        print(f"Hiding '{args.text}' in {args.output} from image {args.filename}", file=log)
+
+        # hide the message and save the new image, only the rows holding
+        # it are encoded again when possible; the rows are streamed
+        # from the standard input, or to the standard output
+        lsb.embed(src, dst, data, key=args.key, channels=args.channels,
+                  bits=args.bits, framed=sealed, stats=stats, pipeline=8 if args.pipeline else None,
+                  region=args.region)
+        if args.output == "-":
+            dst.flush()
 
     elif args.mode == "read":
-        # Find the message
-        msg = find_message(rgba_img)
-        output = subprocess.check_output(["strings"], input=bytes(msg, "utf-8"))
-        print(output.split(b'\n')[0])
\ No newline at end of file
+        # Find the message, verified and decrypted when sealed
+        msg = lsb.extract(src, key=args.key, channels=args.channels,
+                          bits=args.bits, framed=sealed, stats=stats, region=args.region is not None)
+        if sealed:
+            print(msg.decode("utf-8"))
+        elif args.region is not None:
+            # The region header tells the length of the text
+            print(msg.decode("utf-8", errors="replace"))
+        else:
+            print(first_string(msg))
+
+    if stats is not None:
+        json.dump(stats.as_dict(), sys.stderr, indent=2)
+        print(file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
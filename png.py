@@ -136,15 +136,19 @@ the PNG image comes from something that uses a similar format
 
 __version__ = "0.0.20"
 
+import _thread   # For a lock, without importing threading
 import collections
+import contextlib
 import io   # For io.BytesIO
 import itertools
 import math
 # http://www.python.org/doc/2.4.4/lib/module-operator.html
 import operator
+import os
 import re
 import struct
 import sys
+import time
 # http://www.python.org/doc/2.4.4/lib/module-warnings.html
 import warnings
 import zlib
@@ -152,9 +156,14 @@ import zlib
 from array import array
 
 
-__all__ = ['Image', 'Reader', 'Writer', 'write_chunks', 'from_array']
+__all__ = ['Image', 'Raster', 'Reader', 'Stats', 'Writer',
+           'write_chunks', 'from_array']
 
 
+# The size of the stored deflate blocks written by
+# ``Writer(stored=True)``: the largest one.
+STORED_BLOCK = 2 ** 16 - 1
+
 # The PNG signature.
 # http://www.w3.org/TR/PNG/#5PNG-file-signature
 signature = struct.pack('8B', 137, 80, 78, 71, 13, 10, 26, 10)
@@ -333,9 +342,14 @@ class Writer:
                  colormap=None,
                  maxval=None,
                  chunk_limit=2**20,
+                 buffer_size=None,
+                 idat_size=None,
+                 restart_interval=None,
+                 stored=False,
                  x_pixels_per_unit=None,
                  y_pixels_per_unit=None,
-                 unit_is_meter=False):
+                 unit_is_meter=False,
+                 stats=None):
         """
         Create a PNG encoder object.
         Arguments:
@@ -364,6 +378,18 @@ class Writer:
           Create an interlaced image.
         chunk_limit
           Write multiple ``IDAT`` chunks to save memory.
+        buffer_size
+          Bytes of filtered rows gathered before being compressed
+          (default: `chunk_limit`).
+        idat_size
+          Size of the ``IDAT`` chunks written (default: each
+          chunk holds what the compressor returns).
+        restart_interval
+          Number of rows in each independently compressed band
+          (create an ``rsTR`` chunk).
+        stored
+          Store the image data uncompressed, at fixed places
+          (create an ``stLO`` chunk).
         x_pixels_per_unit
           Number of pixels a unit along the x axis (write a
           `pHYs` chunk).
@@ -374,6 +400,9 @@ class Writer:
         unit_is_meter
           `True` to indicate that the unit (for the `pHYs`
           chunk) is metre.
+        stats
+          A :class:`Stats` object recording the time spent,
+          and the amount of data handled, by each encoding stage.
         The image size (in pixels) can be specified either by using the
         `width` and `height` arguments, or with the single `size`
         argument.
@@ -467,6 +496,34 @@ class Writer:
         compressing the image.
         In order to avoid using large amounts of memory,
         multiple ``IDAT`` chunks may be created.
+        `buffer_size` and `idat_size` tune the two sides of this
+        separately: how much filtered data is handed to the
+        compressor at once, and how large the ``IDAT`` chunks are.
+        Every chunk is written in a single call
+        (see :func:`write_chunk`), so chunks of a few tens of
+        kilobytes keep the writes to pipes and sockets few and large.
+        If `restart_interval` is given, the rows are compressed in
+        bands of that many rows.
+        The compressor is fully flushed at the end of each band
+        (so a band never refers to data of the previous one),
+        each band is written in exactly one ``IDAT`` chunk,
+        and a private ``rsTR`` chunk records the interval.
+        As every row uses filter type 0 (None),
+        a band can then be inflated and unfiltered on its own,
+        or replaced without recompressing the following bands.
+        It cannot be used with `interlace`.
+        If `stored` is true, the rows (all with filter type 0) are
+        not compressed: the zlib stream is made of stored deflate
+        blocks of :data:`STORED_BLOCK` bytes (the last one can be
+        shorter), each one in its own ``IDAT`` chunk,
+        and a private ``stLO`` chunk records the block size.
+        The file offset of every sample then follows from the
+        offset of the first ``IDAT`` chunk
+        (see :func:`stored_offset`),
+        so samples can be patched in place, the checksums being
+        updated from the patched bytes only
+        (see :func:`crc32_replace` and :func:`adler32_replace`).
+        It cannot be used with `interlace` or `restart_interval`.
         """
 
         # At the moment the `planes` argument is ignored;
@@ -490,6 +547,18 @@ class Writer:
             raise ProtocolError(
                 "transparent colour not allowed with alpha channel")
 
+        if restart_interval is not None:
+            if not is_natural(restart_interval) or restart_interval <= 0:
+                raise ProtocolError(
+                    "restart_interval must be a positive integer")
+            if interlace:
+                raise ProtocolError(
+                    "restart_interval not allowed with interlace")
+
+        if stored and (interlace or restart_interval is not None):
+            raise ProtocolError(
+                "stored not allowed with interlace or restart_interval")
+
         # bitdepth is either single integer, or tuple of integers.
         # Convert to tuple.
         try:
@@ -550,11 +619,16 @@ class Writer:
         self.bitdepth = int(bitdepth)
         self.compression = compression
         self.chunk_limit = chunk_limit
+        self.buffer_size = buffer_size or chunk_limit
+        self.idat_size = idat_size
+        self.restart_interval = restart_interval
+        self.stored = bool(stored)
         self.interlace = bool(interlace)
         self.palette = palette
         self.x_pixels_per_unit = x_pixels_per_unit
         self.y_pixels_per_unit = y_pixels_per_unit
         self.unit_is_meter = bool(unit_is_meter)
+        self.stats = stats
 
         self.color_type = (4 * self.alpha +
                            2 * (not greyscale) +
@@ -635,12 +709,14 @@ class Writer:
         # and packed into bytes.
 
         if self.rescale:
-            rows = rescale_rows(rows, self.rescale)
+            rows = instrument(self.stats, 'rescale',
+                              rescale_rows(rows, self.rescale))
 
         if self.bitdepth < 8:
-            rows = pack_rows(rows, self.bitdepth)
+            rows = instrument(self.stats, 'pack',
+                              pack_rows(rows, self.bitdepth))
         elif self.bitdepth == 16:
-            rows = unpack_rows(rows)
+            rows = instrument(self.stats, 'pack', unpack_rows(rows))
 
         return self.write_packed(outfile, rows)
 
@@ -667,10 +743,51 @@ class Writer:
             compressor = zlib.compressobj(self.compression)
         else:
             compressor = zlib.compressobj()
+        compress = compressor.compress
+        flush = compressor.flush
+        write = write_chunk
+        stats = self.stats
+        if stats is not None:
+            compress = stats.timed('deflate', compress)
+            flush = stats.timed('deflate', flush)
+            write = stats.timed('write', write, arg=2)
+
+        # The time left to the 'filter' stage, once the nested
+        # stages are accounted for, is the time spent
+        # prefixing each row with its filter type.
+        with timer(stats, 'filter') as counts:
+            deflated = stats.stage('deflate')['bytes_in'] if stats else 0
+            if self.stored:
+                nrows = self._write_stored(outfile, rows, write)
+            else:
+                nrows = self._write_idat(outfile, rows, compress, flush,
+                                         write)
+            if stats and self.stored:
+                counts.update(rows=nrows)
+            elif stats:
+                # The filtered rows are what the compressor was given.
+                filtered = stats.stage('deflate')['bytes_in'] - deflated
+                counts.update(rows=nrows, bytes_in=filtered - nrows,
+                              bytes_out=filtered)
+        # http://www.w3.org/TR/PNG/#11IEND
+        write_chunk(outfile, b'IEND')
+        return nrows
+
+    def _write_idat(self, outfile, rows, compress, flush, write):
+        """
+        Filter and compress the rows into ``IDAT`` chunks
+        (see :meth:`write_packed`).
+        `compress`, `flush` and `write` stand for the methods of the
+        compressor, and for :func:`write_chunk`.
+        Return the number of rows.
+        """
 
         # data accumulates bytes to be compressed for the IDAT chunk;
         # it's compressed when sufficiently large.
         data = bytearray()
+        # compressed accumulates the output of the compressor,
+        # until there is enough of it for an IDAT chunk.
+        compressed = bytearray()
 
         # raise i scope out of the for loop. set to -1, because the for loop
         # sets i to 0 on the first pass
@@ -685,20 +802,86 @@ class Writer:
             # "up", "average", or "paeth" on such a line.
             data.append(0)
             data.extend(row)
-            if len(data) > self.chunk_limit:
-                compressed = compressor.compress(data)
-                if len(compressed):
-                    write_chunk(outfile, b'IDAT', compressed)
+            if self.restart_interval:
+                # One IDAT chunk per band, ending at a full flush point;
+                # the last band is finished below.
+                if (i + 1) % self.restart_interval or i + 1 >= self.height:
+                    continue
+                compressed += compress(data)
+                compressed += flush(zlib.Z_FULL_FLUSH)
+                write(outfile, b'IDAT', compressed)
+                data = bytearray()
+                compressed = bytearray()
+            elif len(data) > self.buffer_size:
+                compressed += compress(data)
                 data = bytearray()
+                compressed = self._write_idat_chunks(
+                    outfile, compressed, write)
+
+        compressed += compress(data)
+        compressed += flush()
+        if self.restart_interval or not self.idat_size:
+            if len(compressed):
+                write(outfile, b'IDAT', compressed)
+        else:
+            compressed = self._write_idat_chunks(outfile, compressed, write)
+            if len(compressed):
+                write(outfile, b'IDAT', compressed)
+        return i + 1
 
-        compressed = compressor.compress(bytes(data))
-        flushed = compressor.flush()
-        if len(compressed) or len(flushed):
-            write_chunk(outfile, b'IDAT', compressed + flushed)
-        # http://www.w3.org/TR/PNG/#11IEND
-        write_chunk(outfile, b'IEND')
+    def _write_stored(self, outfile, rows, write):
+        """
+        Filter the rows, and write them in stored deflate blocks,
+        one ``IDAT`` chunk each (see the `stored` argument).
+        Return the number of rows.
+        """
+
+        # A zlib header announcing no compression.
+        prefix = b'\x78\x01'
+        adler = zlib.adler32(b'')
+
+        def block(data, final):
+            nonlocal prefix, adler
+            adler = zlib.adler32(data, adler)
+            header = struct.pack('<BHH', final, len(data),
+                                 len(data) ^ 0xffff)
+            chunk = prefix + header + data
+            if final:
+                chunk += struct.pack('!I', adler)
+            write(outfile, b'IDAT', chunk)
+            prefix = b''
+
+        data = bytearray()
+        i = -1
+        for i, row in enumerate(rows):
+            data.append(0)
+            data.extend(row)
+            # The last block is written below, with the final bit set.
+            while len(data) > STORED_BLOCK:
+                block(data[:STORED_BLOCK], 0)
+                del data[:STORED_BLOCK]
+        block(data, 1)
         return i + 1
 
+    def _write_idat_chunks(self, outfile, compressed, write):
+        """
+        Write the compressed data in ``IDAT`` chunks of `idat_size`
+        bytes (or in a single one, when it is not set);
+        return the data left for the next chunk.
+        """
+
+        if not self.idat_size:
+            if len(compressed):
+                write(outfile, b'IDAT', compressed)
+            return bytearray()
+        size = self.idat_size
+        end = len(compressed) - len(compressed) % size
+        with memoryview(compressed) as view:
+            for start in range(0, end, size):
+                write(outfile, b'IDAT', view[start:start + size])
+        del compressed[:end]
+        return compressed
+
     def write_preamble(self, outfile):
         # http://www.w3.org/TR/PNG/#5PNG-file-signature
         outfile.write(signature)
@@ -762,6 +945,15 @@ class Writer:
                    int(self.unit_is_meter))
             write_chunk(outfile, b'pHYs', struct.pack("!LLB", *tup))
 
+        # Private chunk, see the `restart_interval` argument.
+        if self.restart_interval:
+            write_chunk(outfile, b'rsTR',
+                        struct.pack("!I", self.restart_interval))
+
+        # Private chunk, see the `stored` argument.
+        if self.stored:
+            write_chunk(outfile, b'stLO', struct.pack("!I", STORED_BLOCK))
+
     def write_array(self, outfile, pixels):
         """
         Write an array that holds all the image values
@@ -784,6 +976,24 @@ class Writer:
                 self.array_scanlines(pixels)
             )
 
+    def write_raster(self, outfile, raster):
+        """
+        Write a :class:`Raster` as a PNG file on the output file.
+        The rows are taken straight from the raster's buffer,
+        without copying them first.
+        """
+
+        if (raster.width, raster.height, raster.planes) != \
+                (self.width, self.height, self.planes):
+            raise ProtocolError(
+                "raster (%dx%d, %d planes) does not match writer"
+                " (%dx%d, %d planes)" %
+                (raster.width, raster.height, raster.planes,
+                 self.width, self.height, self.planes))
+        if self.interlace:
+            return self.write_array(outfile, raster.buffer)
+        return self.write_passes(outfile, raster.rows())
+
     def array_scanlines(self, pixels):
         """
         Generates rows (each a sequence of values) from
@@ -844,18 +1054,71 @@ def write_chunk(outfile, tag, data=b''):
     """
     Write a PNG chunk to the output file, including length and
     checksum.
+    `data` is any object with the buffer interface;
+    it is not copied before being written.
+    The chunk goes out in a single write
+    (see :func:`write_parts`).
     """
 
-    data = bytes(data)
+    try:
+        data = memoryview(data).cast('B')
+    except TypeError:
+        # A sequence of values, or a non contiguous buffer.
+        data = bytes(data)
     # http://www.w3.org/TR/PNG/#5Chunk-layout
-    outfile.write(struct.pack("!I", len(data)))
-    outfile.write(tag)
-    outfile.write(data)
-    checksum = zlib.crc32(tag)
-    checksum = zlib.crc32(data, checksum)
-    checksum &= 2 ** 32 - 1
-    outfile.write(struct.pack("!I", checksum))
+    checksum = zlib.crc32(data, zlib.crc32(tag))
+    write_parts(outfile, (struct.pack("!I4s", len(data), tag), data,
+                          struct.pack("!I", checksum)))
+
+
+# The parts of a chunk smaller than this are joined before they
+# are written to a file without os.writev (see write_parts).
+JOIN_LIMIT = 2 ** 16
+
+
+def write_parts(outfile, parts):
+    """
+    Write the buffers `parts` to the output file.
+    A blocking raw file, such as a pipe or
+    ``open(path, 'wb', buffering=0)``, gets them in one
+    :func:`os.writev` system call, with no copy.
+    Any other file, such as a socket file (which keeps its
+    timeout this way), gets them joined in one write when they
+    are smaller than `JOIN_LIMIT` bytes,
+    and one after the other otherwise (joining them would copy
+    a large chunk).
+    """
 
+    try:
+        fd = outfile.fileno() if isinstance(outfile, io.FileIO) else None
+        if fd is not None and not os.get_blocking(fd):
+            fd = None
+    except (OSError, AttributeError):
+        fd = None
+    if fd is None or not hasattr(os, 'writev'):
+        raw = isinstance(outfile, io.RawIOBase)
+        if sum(map(len, parts)) < JOIN_LIMIT:
+            parts = (b''.join(parts), )
+        for part in parts:
+            view = memoryview(part)
+            while view:
+                written = outfile.write(view)
+                if not raw:
+                    break
+                if written is None:
+                    raise BlockingIOError(
+                        "The output file is not ready to be written")
+                # A raw file may write only part of it.
+                view = view[written:]
+        return
+    views = [memoryview(part) for part in parts]
+    while views:
+        written = os.writev(fd, views)
+        # Drop what was written, and write the rest again.
+        while views and written >= len(views[0]):
+            written -= len(views.pop(0))
+        if views:
+            views[0] = views[0][written:]
 
 def write_chunks(out, chunks):
     """Create a PNG file by writing out the chunks."""
@@ -909,27 +1172,24 @@ def pack_rows(rows, bitdepth):
     # samples per byte
     spb = int(8 / bitdepth)
 
-    def make_byte(block):
-        """Take a block of (2, 4, or 8) values,
-        and pack them into a single byte.
-        """
-
-        res = 0
-        for v in block:
-            res = (res << bitdepth) + v
-        return res
+    # The k-th sample of each byte goes through the k-th table,
+    # which shifts it into its place in the byte.
+    # The bits of the shifted samples do not overlap,
+    # so a byte is the bitwise or of its shifted samples,
+    # which is done for the whole row at once on big integers.
+    tables = [bytes((v << (bitdepth * (spb - 1 - k))) & 0xff
+                    for v in range(256))
+              for k in range(spb)]
 
     for row in rows:
         a = bytearray(row)
         # Adding padding bytes so we can group into a whole
         # number of spb-tuples.
-        n = float(len(a))
-        extra = math.ceil(n / spb) * spb - n
-        a.extend([0] * int(extra))
-        # Pack into bytes.
-        # Each block is the samples for one byte.
-        blocks = group(a, spb)
-        yield bytearray(make_byte(block) for block in blocks)
+        a.extend(bytes(-len(a) % spb))
+        packed = 0
+        for k, table in enumerate(tables):
+            packed |= int.from_bytes(a[k::spb].translate(table), 'big')
+        yield bytearray(packed.to_bytes(len(a) // spb, 'big'))
 
 
 def unpack_rows(rows):
@@ -937,8 +1197,18 @@ def unpack_rows(rows):
     to being a sequence of bytes.
     """
     for row in rows:
-        fmt = '!%dH' % len(row)
-        yield bytearray(struct.pack(fmt, *row))
+        if isinstance(row, memoryview) and row.format == 'H':
+            a = array('H')
+            a.frombytes(row.cast('B'))
+        else:
+            if isinstance(row, (bytes, bytearray)):
+                # Take the values, not the raw bytes.
+                row = iter(row)
+            a = array('H', row)
+        # PNG is big-endian.
+        if sys.byteorder == 'little':
+            a.byteswap()
+        yield bytearray(a.tobytes())
 
 
 def make_palette_chunks(palette):
@@ -1011,7 +1281,7 @@ def check_bitdepth_rescale(
     return targetbitdepth, [(b, targetbitdepth) for b in bitdepth]
 
 
-# Regex for decoding mode string
+# Regex for decoding mode string.
 RegexModeDecode = re.compile("(LA?|RGBA?);?([0-9]*)", flags=re.IGNORECASE)
 
 
@@ -1229,12 +1499,341 @@ class Image:
         w.write(file, self.rows)
 
 
+class Raster:
+    """
+    A decoded image held in a single contiguous buffer.
+    The values are in the *array of values* format
+    (see the module documentation):
+    a ``bytearray`` when the bit depth is 8 or less,
+    an ``array('H')`` when it is more.
+    Rows are exposed as ``memoryview`` objects on that buffer,
+    so they can be read and modified in place without copying.
+    The buffer supports the buffer protocol,
+    ``numpy.asarray(raster.memoryview())`` is a
+    ``height x (width * planes)`` array sharing its memory.
+    """
+
+    def __init__(self, width, height, planes, bitdepth,
+                 buffer=None, info=None):
+        """
+        Create a raster of `width` by `height` pixels,
+        each one having `planes` values of `bitdepth` bits.
+        If `buffer` is given it is used as it is (not copied)
+        and must have the right length and type;
+        otherwise a zero filled buffer is allocated.
+        `info` is an optional dictionary of metadata,
+        like the one returned by :meth:`Reader.read`.
+        """
+
+        self.width = width
+        self.height = height
+        self.planes = planes
+        self.bitdepth = bitdepth
+        self.info = dict(info or {})
+        n = width * height * planes
+        if buffer is None:
+            if bitdepth > 8:
+                buffer = array('H', [0]) * n
+            else:
+                buffer = bytearray(n)
+        if len(buffer) != n:
+            raise ProtocolError(
+                "buffer has %d values, expected %d" % (len(buffer), n))
+        if (bitdepth > 8) != (isarray(buffer) and buffer.itemsize > 1):
+            raise ProtocolError(
+                "buffer type does not match bitdepth %d" % bitdepth)
+        self.buffer = buffer
+        self.vpr = width * planes
+
+    def row(self, y):
+        """
+        Return row `y` as a ``memoryview`` on the buffer.
+        """
+
+        start = y * self.vpr
+        return memoryview(self.buffer)[start:start + self.vpr]
+
+    def rows(self):
+        """
+        Iterator that yields each row as a ``memoryview``
+        on the buffer.
+        """
+
+        view = memoryview(self.buffer)
+        for start in range(0, len(self.buffer), self.vpr):
+            yield view[start:start + self.vpr]
+
+    def memoryview(self):
+        """
+        Return a 2-dimensional ``memoryview`` of the buffer,
+        of shape (*height*, *width* * *planes*).
+        """
+
+        view = memoryview(self.buffer)
+        return view.cast('B').cast(view.format, (self.height, self.vpr))
+
+
+class Stats:
+    """
+    Instrumentation of the decoding and encoding pipelines.
+    A :class:`Reader` or a :class:`Writer` given a `stats` object
+    records, for each of its stages
+    (``idat``, ``inflate``, ``unfilter``, ``palette``, ``deflate``,
+    ``write`` and so on),
+    the number of calls, the wall time, the bytes in and out,
+    and the number of rows.
+    The same object can be shared by a reader, a writer
+    and the code in between, which then adds its own stages
+    with :meth:`timer`, :meth:`iterate` or :meth:`timed`.
+    Stages nest: `seconds` is the inclusive time of a stage,
+    `self_seconds` excludes the time spent in the stages it called
+    (for an iterator, the stages that produced its input);
+    when the bytes in of a stage are not given explicitly
+    they are the bytes of the items its nested iterators produced.
+    When no `stats` object is given nothing is recorded,
+    and the pipelines run exactly as without instrumentation.
+    A :class:`Stats` object can be shared by the threads of
+    a pipeline: the nesting of the stages is tracked per thread
+    (so the times of stages running on different threads overlap).
+    """
+
+    FIELDS = ('calls', 'seconds', 'self_seconds',
+              'bytes_in', 'bytes_out', 'rows')
+
+    def __init__(self, clock=time.perf_counter):
+        # Only needed once stats are recorded.
+        import threading
+
+        self.clock = clock
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def _stack(self):
+        # One [seconds, bytes] entry per stage being timed
+        # by the current thread, accumulating what its nested
+        # stages spent and produced.
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def stage(self, name):
+        """
+        Return the dictionary of counters of the stage `name`.
+        """
+
+        counters = self.stages.get(name)
+        if counters is None:
+            counters = self.stages.setdefault(
+                name, dict.fromkeys(self.FIELDS, 0))
+        return counters
+
+    def add(self, name, **counts):
+        """
+        Add `counts` (keyword arguments named after :attr:`FIELDS`)
+        to the counters of the stage `name`.
+        """
+
+        with self._lock:
+            counters = self.stage(name)
+            for field, n in counts.items():
+                counters[field] += n
+
+    def _begin(self):
+        self._stack.append([0.0, 0])
+        return self.clock()
+
+    def _end(self, name, start, bytes_in=0, bytes_out=0, rows=0,
+             produced=False):
+        elapsed = self.clock() - start
+        stack = self._stack
+        nested_seconds, nested_bytes = stack.pop()
+        if stack:
+            stack[-1][0] += elapsed
+            if produced:
+                # An item handed to the calling stage: its input.
+                stack[-1][1] += bytes_out
+        with self._lock:
+            counters = self.stage(name)
+            counters['calls'] += 1
+            counters['seconds'] += elapsed
+            counters['self_seconds'] += elapsed - nested_seconds
+            counters['bytes_in'] += bytes_in or nested_bytes
+            counters['bytes_out'] += bytes_out
+            counters['rows'] += rows
+
+    @contextlib.contextmanager
+    def timer(self, name, bytes_in=0, bytes_out=0, rows=0):
+        """
+        Context manager timing its block as one call of the
+        stage `name`.
+        It yields a dictionary of the counts to record,
+        that the block can update once they are known.
+        """
+
+        counts = dict(bytes_in=bytes_in, bytes_out=bytes_out, rows=rows)
+        start = self._begin()
+        try:
+            yield counts
+        finally:
+            self._end(name, start, **counts)
+
+    def iterate(self, name, iterable, rows=True):
+        """
+        Iterator that yields the items of `iterable`,
+        timing the production of each one as a call of
+        the stage `name`.
+        Each item is counted as a row,
+        unless `rows` is false (the items are blocks of data).
+        """
+
+        it = iter(iterable)
+        while True:
+            start = self._begin()
+            try:
+                item = next(it)
+            except StopIteration:
+                self._end(name, start)
+                return
+            except BaseException:
+                self._end(name, start)
+                raise
+            self._end(name, start, bytes_out=nbytes(item), rows=int(rows),
+                      produced=True)
+            yield item
+
+    def timed(self, name, fn, arg=0):
+        """
+        Return a function calling `fn`,
+        and timing each call as a call of the stage `name`.
+        The bytes in are the size of its positional argument
+        number `arg` (when it has one), the bytes out the size
+        of its result.
+        """
+
+        def wrapper(*args):
+            start = self._begin()
+            result = None
+            try:
+                result = fn(*args)
+                return result
+            finally:
+                size = nbytes(args[arg]) if len(args) > arg else 0
+                self._end(name, start, bytes_in=size,
+                          bytes_out=nbytes(result))
+        return wrapper
+
+    def as_dict(self):
+        """
+        Return the counters of every stage, as a dictionary
+        (in the order the stages were first recorded)
+        that can be serialised as JSON.
+        """
+
+        with self._lock:
+            return {name: dict(counters)
+                    for name, counters in self.stages.items()}
+
+
+def instrument(stats, name, iterable, rows=True):
+    """
+    Return `iterable`, or when `stats` is given,
+    an iterator timing it as the stage `name`
+    (see :meth:`Stats.iterate`).
+    """
+
+    if stats is None:
+        return iterable
+    return stats.iterate(name, iterable, rows)
+
+
+def timer(stats, name, **counts):
+    """
+    Return a context manager timing its block as the stage `name`
+    when `stats` is given (see :meth:`Stats.timer`),
+    one doing nothing otherwise.
+    """
+
+    if stats is None:
+        return contextlib.nullcontext()
+    return stats.timer(name, **counts)
+
+
+def nbytes(x):
+    """
+    Return the size in bytes of `x`;
+    `x` is a buffer, a sequence of values (counted as bytes), or `None`.
+    """
+
+    if x is None or isinstance(x, int):
+        return 0
+    try:
+        return memoryview(x).nbytes
+    except TypeError:
+        return len(x)
+
+
+class Readahead:
+    """
+    A file reading ahead of its reader: the input file is read in
+    large blocks of `size` bytes (or more), and the small reads of
+    the chunk lengths, types and checksums are served from them.
+    Short reads of the input (pipes and sockets return what they
+    have) are repeated until the requested size or the end of the
+    file.
+    :class:`Reader` wraps the files that cannot seek in one.
+    """
+
+    def __init__(self, file, size=2**16):
+        self.file = file
+        self.size = size
+        self.buffer = bytearray()
+        self.pos = 0
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            data = bytes(self.buffer[self.pos:])
+            self.buffer, self.pos = bytearray(), 0
+            rest = self.file.read()
+            return data + rest if rest else data
+        if self.pos == len(self.buffer) and n >= self.size:
+            # A large read: straight from the file, without a copy.
+            data = self.file.read(n)
+            if data is None or len(data) >= n:
+                return data
+            self.buffer += data
+        while len(self.buffer) - self.pos < n:
+            more = self.file.read(max(self.size, n - len(self.buffer) + self.pos))
+            if not more:
+                break
+            if self.pos:
+                del self.buffer[:self.pos]
+                self.pos = 0
+            self.buffer += more
+        data = bytes(self.buffer[self.pos:self.pos + n])
+        self.pos += len(data)
+        return data
+
+    def seekable(self):
+        return False
+
+    def close(self):
+        self.file.close()
+
+
 class Reader:
     """
     Pure Python PNG decoder in pure Python.
     """
 
-    def __init__(self, _guess=None, filename=None, file=None, bytes=None):
+    # The policies telling which chunk checksums are verified.
+    VERIFY = ('full', 'defer', 'skip-idat', 'skip-all')
+
+    def __init__(self, _guess=None, filename=None, file=None, bytes=None,
+                 stats=None, verify='full', readahead=2**16):
         """
         The constructor expects exactly one keyword argument.
         If you supply a positional argument instead,
@@ -1246,7 +1845,26 @@ class Reader:
           A file-like object (object with a read() method).
         bytes
           ``bytes`` or ``bytearray`` with PNG data.
+        A :class:`Stats` object can be given as the `stats` keyword
+        argument, to record the time spent in each decoding stage.
+        The `verify` keyword argument tells which chunk checksums
+        (CRC) are verified:
+        ``'full'`` (the default) verifies each chunk as it is read;
+        ``'defer'`` verifies the ``IDAT`` chunks on a background
+        thread, while their data is inflated, and reports all the
+        mismatches at once after the last chunk
+        (see :meth:`verify_checksums`);
+        ``'skip-idat'`` does not verify the ``IDAT`` chunks,
+        and ``'skip-all'`` verifies no chunk at all.
+        The last two are meant for trusted files,
+        such as the ones just written by :class:`Writer`.
+        A `file` that cannot seek (a pipe, a socket, or
+        :func:`binary_stdin`) is read through a :class:`Readahead`
+        buffer of `readahead` bytes, unless it is 0.
         """
+        if verify not in self.VERIFY:
+            raise ProtocolError(
+                "verify must be one of %s, not %r" % (self.VERIFY, verify))
         keywords_supplied = (
             (_guess is not None) +
             (filename is not None) +
@@ -1263,6 +1881,15 @@ class Reader:
         # past the 4 bytes that specify the chunk type).
         # See preamble method for how this is used.
         self.atchunk = None
+        self.stats = stats
+        self.verify = verify
+        # The chunks whose checksums are deferred to a background
+        # thread (see checksum_pool): the batch being filled, as
+        # (type, data, checksum) triples, and the futures of the
+        # batches handed off.
+        self._crc_batch = []
+        self._crc_batch_size = 0
+        self._crc_pending = []
 
         if _guess is not None:
             if isarray(_guess):
@@ -1278,6 +1905,9 @@ class Reader:
             self.file = open(filename, "rb")
         elif file is not None:
             self.file = file
+            seekable = getattr(file, 'seekable', lambda: False)()
+            if readahead and not seekable and not isinstance(file, Readahead):
+                self.file = Readahead(file, readahead)
         else:
             raise ProtocolError("expecting filename, file or bytes array")
 
@@ -1310,19 +1940,76 @@ class Reader:
         checksum = self.file.read(4)
         if len(checksum) != 4:
             raise ChunkError('Chunk %s too short for checksum.' % type)
-        verify = zlib.crc32(type)
-        verify = zlib.crc32(data, verify)
-        verify = struct.pack('!I', verify)
-        if checksum != verify:
-            (a, ) = struct.unpack('!I', checksum)
-            (b, ) = struct.unpack('!I', verify)
+        self._verify_checksum(type, data, checksum, lenient)
+        if type == b'IEND':
+            self.verify_checksums(lenient)
+        return type, data
+
+    def _verify_checksum(self, type, data, checksum, lenient=False):
+        """
+        Verify the `checksum` of a chunk, following the `verify`
+        policy of the reader.
+        """
+
+        if self.verify == 'skip-all':
+            return
+        if type == b'IDAT' and self.verify == 'skip-idat':
+            return
+        (expected, ) = struct.unpack('!I', checksum)
+        if type == b'IDAT' and self.verify == 'defer':
+            # The chunks are verified in batches of about a megabyte,
+            # so that small chunks do not cost a hand off each.
+            self._crc_batch.append((type, data, expected))
+            self._crc_batch_size += len(data)
+            if self._crc_batch_size >= 2 ** 20:
+                self._defer_checksums()
+            return
+        actual = zlib.crc32(data, zlib.crc32(type))
+        if actual != expected:
             message = ("Checksum error in %s chunk: 0x%08X != 0x%08X."
-                       % (type.decode('ascii'), a, b))
+                       % (type.decode('ascii'), expected, actual))
+            if lenient:
+                warnings.warn(message, RuntimeWarning)
+            else:
+                raise ChunkError(message)
+
+    def _defer_checksums(self):
+        """
+        Hand the batch of chunks waiting to be verified
+        to the background thread.
+        """
+
+        if not self._crc_batch:
+            return
+        # zlib.crc32 releases the GIL on large buffers,
+        # so this overlaps with the inflating of the data.
+        self._crc_pending.append(
+            checksum_pool().submit(mismatched_checksums, self._crc_batch))
+        self._crc_batch = []
+        self._crc_batch_size = 0
+
+    def verify_checksums(self, lenient=False):
+        """
+        Wait for the checksums deferred by the ``'defer'`` policy
+        (see :class:`Reader`), and report all their mismatches at
+        once: a single :class:`ChunkError` listing them,
+        or a single warning if the optional `lenient` argument
+        evaluates to `True`.
+        It is called once the ``IEND`` chunk is read.
+        """
+
+        self._defer_checksums()
+        pending, self._crc_pending = self._crc_pending, []
+        errors = []
+        for future in pending:
+            errors.extend(future.result())
+        if errors:
+            message = ("Checksum error in %d chunks: %s."
+                       % (len(errors), ", ".join(errors)))
             if lenient:
                 warnings.warn(message, RuntimeWarning)
             else:
                 raise ChunkError(message)
-        return type, data
 
     def chunks(self):
         """Return an iterator that will yield each chunk as a
@@ -1459,8 +2146,12 @@ class Reader:
         if self.bitdepth == 8:
             return bytearray(bs)
         if self.bitdepth == 16:
-            return array('H',
-                         struct.unpack('!%dH' % (len(bs) // 2), bs))
+            a = array('H')
+            a.frombytes(bs)
+            # PNG is big-endian.
+            if sys.byteorder == 'little':
+                a.byteswap()
+            return a
 
         assert self.bitdepth < 8
         if width is None:
@@ -1630,6 +2321,10 @@ class Reader:
         self.trns = None
         # Stores sBIT chunk if present.
         self.sbit = None
+        # Rows per independently compressed band (private rsTR chunk).
+        self.restart_interval = None
+        # Size of the stored deflate blocks (private stLO chunk).
+        self.stored_block = None
 
     def _process_PLTE(self, data):
         # http://www.w3.org/TR/PNG/#11PLTE
@@ -1691,6 +2386,24 @@ class Reader:
                 not self.colormap and len(data) != self.planes):
             raise FormatError("sBIT chunk has incorrect length.")
 
+    def _process_rsTR(self, data):
+        # Private chunk written by Writer(restart_interval=...)
+        try:
+            (self.restart_interval, ) = struct.unpack("!I", data)
+        except struct.error:
+            raise FormatError("rsTR chunk has incorrect length.")
+        if self.restart_interval == 0 or self.interlace:
+            raise FormatError("rsTR chunk is invalid for this image.")
+
+    def _process_stLO(self, data):
+        # Private chunk written by Writer(stored=True)
+        try:
+            (self.stored_block, ) = struct.unpack("!I", data)
+        except struct.error:
+            raise FormatError("stLO chunk has incorrect length.")
+        if not 0 < self.stored_block <= STORED_BLOCK or self.interlace:
+            raise FormatError("stLO chunk is invalid for this image.")
+
     def _process_pHYs(self, data):
         # http://www.w3.org/TR/PNG/#11pHYs
         self.phys = data
@@ -1712,23 +2425,8 @@ class Reader:
         checksum failures will raise warnings rather than exceptions.
         """
 
-        def iteridat():
-            """Iterator that yields all the ``IDAT`` chunks as strings."""
-            while True:
-                type, data = self.chunk(lenient=lenient)
-                if type == b'IEND':
-                    # http://www.w3.org/TR/PNG/#11IEND
-                    break
-                if type != b'IDAT':
-                    continue
-                # type == b'IDAT'
-                # http://www.w3.org/TR/PNG/#11IDAT
-                if self.colormap and not self.plte:
-                    warnings.warn("PLTE chunk is required before IDAT chunk")
-                yield data
-
         self.preamble(lenient=lenient)
-        raw = decompress(iteridat())
+        raw = self._inflate(lenient=lenient)
 
         if self.interlace:
             def rows_from_interlace():
@@ -1744,9 +2442,46 @@ class Reader:
                 for i in range(0, len(values), vpr):
                     row = array(arraycode, values[i:i+vpr])
                     yield row
-            rows = rows_from_interlace()
+            rows = instrument(self.stats, 'deinterlace',
+                              rows_from_interlace())
         else:
-            rows = self._iter_bytes_to_values(self._iter_straight_packed(raw))
+            packed = instrument(self.stats, 'unfilter',
+                                self._iter_straight_packed(raw))
+            rows = instrument(self.stats, 'unpack',
+                              self._iter_bytes_to_values(packed))
+        return self.width, self.height, rows, self._info()
+
+    def _inflate(self, lenient=False):
+        """
+        Iterator that yields the decompressed ``IDAT`` data
+        in blocks (see :func:`decompress`).
+        """
+
+        idat = instrument(self.stats, 'idat', self._iter_idat(lenient),
+                          rows=False)
+        return instrument(self.stats, 'inflate', decompress(idat),
+                          rows=False)
+
+    def _iter_idat(self, lenient=False):
+        """Iterator that yields all the ``IDAT`` chunks as strings."""
+        while True:
+            type, data = self.chunk(lenient=lenient)
+            if type == b'IEND':
+                # http://www.w3.org/TR/PNG/#11IEND
+                break
+            if type != b'IDAT':
+                continue
+            # type == b'IDAT'
+            # http://www.w3.org/TR/PNG/#11IDAT
+            if self.colormap and not self.plte:
+                warnings.warn("PLTE chunk is required before IDAT chunk")
+            yield data
+
+    def _info(self):
+        """
+        The `info` dictionary returned by :meth:`read`.
+        """
+
         info = dict()
         for attr in 'greyscale alpha planes bitdepth interlace'.split():
             info[attr] = getattr(self, attr)
@@ -1761,7 +2496,198 @@ class Reader:
                                           self.unit_is_meter)
         if self.plte:
             info['palette'] = self.palette()
-        return self.width, self.height, rows, info
+        return info
+
+    def read_into(self, buffer, lenient=False, workers=1):
+        """
+        Read the PNG file and decode it into `buffer`,
+        a writable buffer supplied by the caller.
+        Returns (`width`, `height`, `buffer`, `info`).
+        The values are those of :meth:`read`, flat in a single array:
+        `buffer` must be a ``bytearray`` (or an ``array('B')``)
+        of *width* * *height* * *planes* values when the
+        bit depth is 8 or less, an ``array('H')`` of that length
+        when it is 16.
+        Straightlaced images are unfiltered with a single pair
+        of scratch scanlines, and each row is stored in place,
+        so no row is allocated;
+        interlaced images are decoded as in :meth:`read`.
+        Images with restart points (an ``rsTR`` chunk,
+        see the `restart_interval` option of :class:`Writer`)
+        can have their bands inflated ahead on `workers` threads,
+        when there is more than one (default: 1, the data is then
+        inflated as a single stream): zlib runs in parallel,
+        the unfiltering still runs in turn, band after band.
+        If the optional `lenient` argument evaluates to True,
+        checksum failures will raise warnings rather than exceptions.
+        """
+
+        self.preamble(lenient=lenient)
+        vpr = self.width * self.planes
+        if len(buffer) != vpr * self.height:
+            raise ProtocolError(
+                "buffer has %d values, expected %d" %
+                (len(buffer), vpr * self.height))
+        if (self.bitdepth > 8) != (isarray(buffer) and buffer.itemsize > 1):
+            raise ProtocolError(
+                "buffer type does not match bitdepth %d" % self.bitdepth)
+
+        stats = self.stats
+        if self.restart_interval and workers > 1:
+            bands = list(instrument(stats, 'idat', self._iter_idat(lenient),
+                                    rows=False))
+            raw = None
+            if len(bands) == -(-self.height // self.restart_interval):
+                with memoryview(buffer) as view, view.cast('B') as dest:
+                    self._read_bands_into(bands, dest, workers, lenient)
+            else:
+                # The IDAT chunks were split or merged since they
+                # were written: they are not bands.
+                raw = instrument(stats, 'inflate', decompress(bands),
+                                 rows=False)
+        else:
+            raw = self._inflate(lenient=lenient)
+        if self.interlace:
+            with timer(stats, 'deinterlace', rows=self.height):
+                buffer[:] = self._deinterlace(
+                    bytearray(itertools.chain(*raw)))
+            return self.width, self.height, buffer, self._info()
+        if raw is not None:
+            with timer(stats, 'unfilter', rows=self.height) as counts:
+                with memoryview(buffer) as view, view.cast('B') as dest:
+                    self._unfilter_into(raw, dest)
+                if stats:
+                    counts['bytes_out'] = nbytes(buffer)
+        if self.bitdepth > 8 and sys.byteorder == 'little':
+            # PNG is big-endian.
+            buffer.byteswap()
+        return self.width, self.height, buffer, self._info()
+
+    def _unfilter_into(self, raw, dest, previous=None):
+        """
+        Unfilter the straightlaced decompressed data `raw`
+        (an iterable of blocks) into `dest`,
+        a ``memoryview`` of bytes on the values of its rows
+        (see :meth:`read_into`; 16-bit values are stored
+        as big-endian bytes, and are not swapped).
+        `previous` is the (unfiltered) row above the first one,
+        if any.
+        Returns the last unfiltered row.
+        """
+
+        vpr = self.width * self.planes
+        rb = self.row_bytes
+        fu = max(1, self.psize)
+        # The scratch scanlines, swapped after each row.
+        # Without a previous row, the first row is unfiltered against
+        # a row of zeroes, which is the same.
+        cur = bytearray(rb)
+        prev = bytearray(previous or rb)
+        fns = (None,
+               undo_filter_sub,
+               undo_filter_up,
+               undo_filter_average,
+               undo_filter_paeth)
+        if self.bitdepth < 8:
+            spb = 8 // self.bitdepth
+            tables = unpack_tables[self.bitdepth]
+        step = vpr * (2 if self.bitdepth > 8 else 1)
+        offset = 0
+        pending = bytearray()
+        for block in raw:
+            pending.extend(block)
+            pos = 0
+            with memoryview(pending) as view:
+                while len(pending) - pos >= rb + 1:
+                    filter_type = pending[pos]
+                    cur[:] = view[pos + 1: pos + 1 + rb]
+                    pos += rb + 1
+                    if filter_type:
+                        if filter_type not in (1, 2, 3, 4):
+                            raise FormatError(
+                                'Invalid PNG Filter Type.  See '
+                                'http://www.w3.org/TR/2003/'
+                                'REC-PNG-20031110/#9Filters .')
+                        fns[filter_type](fu, cur, prev, cur)
+                    if self.bitdepth < 8:
+                        # The k-th sample of each byte
+                        # goes through the k-th table.
+                        for k, table in enumerate(tables):
+                            n = len(range(k, vpr, spb))
+                            dest[offset + k: offset + vpr: spb] = \
+                                cur.translate(table)[:n]
+                    else:
+                        dest[offset: offset + step] = cur
+                    offset += step
+                    prev, cur = cur, prev
+            del pending[:pos]
+        if len(pending) != 0 or offset != len(dest):
+            raise FormatError('Wrong size for decompressed IDAT chunk.')
+        return prev
+
+    def _read_bands_into(self, bands, dest, workers=2, lenient=False):
+        """
+        Inflate and unfilter the bands of rows
+        (the data of the ``IDAT`` chunks of an image with
+        restart points) into `dest`, a ``memoryview`` of bytes
+        (see :meth:`_unfilter_into`).
+        Up to `workers` bands are inflated ahead on threads,
+        while each band is unfiltered in turn on this one,
+        so only those bands are held inflated at once.
+        """
+
+        # zlib releases the GIL, so threads inflate in parallel.
+        import concurrent.futures
+
+        stats = self.stats
+        interval = self.restart_interval
+        rb = self.row_bytes
+        step = len(dest) // self.height
+        last = len(bands) - 1
+
+        def inflate(i):
+            # Each band starts after a full flush point:
+            # the ones after the first are raw deflate data
+            # (no zlib header), and they all end on a byte boundary.
+            if i == 0:
+                d = zlib.decompressobj()
+            else:
+                d = zlib.decompressobj(-zlib.MAX_WBITS)
+            with timer(stats, 'inflate', bytes_in=len(bands[i])) as counts:
+                data = d.decompress(bands[i])
+                if stats:
+                    counts['bytes_out'] = len(data)
+            n_rows = min(interval, self.height - i * interval)
+            if len(data) != n_rows * (rb + 1) or (i == last) != d.eof:
+                raise FormatError(
+                    "Restart points do not match the rows of the image.")
+            trailer = d.unused_data if i == last and i else None
+            return data, zlib.adler32(data), trailer
+
+        adler = None
+        previous = None
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            ahead = collections.deque(
+                pool.submit(inflate, i) for i in range(min(workers, last + 1)))
+            for i in range(last + 1):
+                data, band_adler, trailer = ahead.popleft().result()
+                if i + workers <= last:
+                    ahead.append(pool.submit(inflate, i + workers))
+                start = i * interval * step
+                band = dest[start: start + len(data) // (rb + 1) * step]
+                with timer(stats, 'unfilter', rows=len(data) // (rb + 1),
+                           bytes_in=len(data), bytes_out=len(band)):
+                    previous = self._unfilter_into((data,), band, previous)
+                adler = (band_adler if adler is None else
+                         adler32_combine(adler, band_adler, len(data)))
+        # Without the zlib wrapper, the Adler-32 of the whole
+        # data is checked here.
+        if last and trailer[:4] != struct.pack('!I', adler):
+            message = "IDAT data has a wrong Adler-32."
+            if lenient:
+                warnings.warn(message, RuntimeWarning)
+            else:
+                raise FormatError(message)
 
     def read_flat(self):
         """
@@ -1778,6 +2704,157 @@ class Reader:
         pixel = array(arraycode, itertools.chain(*pixel))
         return x, y, pixel, info
 
+    def read_raster(self, method=None, workers=1):
+        """
+        Decode the PNG file into a :class:`Raster`.
+        `method` is the method used to decode the rows;
+        it defaults to :meth:`read`,
+        and can be any method returning
+        (*width*, *height*, *rows*, *info*)
+        such as :meth:`asDirect` or :meth:`asRGBA8`.
+        Each row is copied once, straight into the raster's buffer,
+        and is not kept.
+        Without a `method`, the rows are decoded straight into the
+        buffer by :meth:`read_into` (on `workers` threads).
+        """
+
+        if method is None:
+            self.preamble()
+            raster = Raster(self.width, self.height, self.planes,
+                            self.bitdepth)
+            raster.info = self.read_into(raster.buffer, workers=workers)[3]
+            return raster
+        width, height, rows, info = method()
+        raster = Raster(width, height, info['planes'], info['bitdepth'],
+                        info=info)
+        buffer = raster.buffer
+        vpr = raster.vpr
+        wide = isarray(buffer)
+        for y, row in enumerate(rows):
+            if wide and not isarray(row):
+                row = array('H', row)
+            buffer[y * vpr:(y + 1) * vpr] = row
+        return raster
+
+    def read_rows(self, start, stop, lenient=False):
+        """
+        Decode the rows from `start` (included) to `stop` (excluded)
+        into a :class:`Raster` of *stop* - *start* rows.
+        The values are those of :meth:`read`.
+        When the image has restart points (an ``rsTR`` chunk,
+        see the `restart_interval` option of :class:`Writer`)
+        and the file can seek, only the bands holding the rows are
+        read and decoded: the file seeks from one ``IDAT`` chunk
+        header to the next one (each band is one chunk) up to the
+        first band wanted.
+        A band whose first row needs the previous one to be unfiltered
+        (filter type 2, 3 or 4) is decoded with the bands above it.
+        It can then be called several times on the same reader,
+        the offsets of the bands are kept.
+        Otherwise the image is decoded from its top, up to `stop`
+        (and like :meth:`read`, this can be done once).
+        If the optional `lenient` argument evaluates to True,
+        checksum failures will raise warnings rather than exceptions.
+        """
+
+        if not hasattr(self, '_band_chunks'):
+            self.preamble(lenient=lenient)
+        if not 0 <= start <= stop <= self.height:
+            raise ProtocolError(
+                "rows %d to %d are not in the image (height %d)" %
+                (start, stop, self.height))
+        raster = Raster(self.width, stop - start, self.planes, self.bitdepth,
+                        info=self._info())
+        raster.info['size'] = (self.width, stop - start)
+        seekable = getattr(self.file, 'seekable', lambda: False)()
+        if not self.restart_interval or not seekable:
+            rows = itertools.islice(self.read(lenient)[2], start, stop)
+            buffer = raster.buffer
+            for y, row in enumerate(rows):
+                buffer[y * raster.vpr: (y + 1) * raster.vpr] = row
+            return raster
+        if start == stop:
+            return raster
+
+        interval = self.restart_interval
+        first, last = start // interval, (stop - 1) // interval
+        bands = {}
+        b = first
+        while True:
+            data = self._inflate_band(b, lenient)
+            bands[b] = data
+            if b == 0 or data[0] not in (2, 3, 4):
+                break
+            b -= 1
+        for i in range(first + 1, last + 1):
+            bands[i] = self._inflate_band(i, lenient)
+
+        # Unfilter all the bands, then keep the rows asked for.
+        top = b * interval
+        n_rows = min(self.height, (last + 1) * interval) - top
+        step = self.width * self.planes * (2 if self.bitdepth > 8 else 1)
+        values = Raster(self.width, n_rows, self.planes, self.bitdepth)
+        with memoryview(values.buffer) as view, view.cast('B') as dest:
+            self._unfilter_into((bands[i] for i in sorted(bands)), dest)
+        if self.bitdepth > 8 and sys.byteorder == 'little':
+            # PNG is big-endian.
+            values.buffer.byteswap()
+        offset = (start - top) * raster.vpr
+        raster.buffer[:] = values.buffer[offset: offset + len(raster.buffer)]
+        self.verify_checksums(lenient)
+        return raster
+
+    def _inflate_band(self, b, lenient=False):
+        """
+        Read and inflate the band `b` of an image with
+        restart points (see :meth:`read_rows`).
+        """
+
+        if not hasattr(self, '_band_chunks'):
+            # The first IDAT chunk, whose length and type
+            # the preamble has just read.
+            length, type = self.atchunk
+            self.atchunk = None
+            self._band_chunks = [(self.file.tell(), length)]
+        chunks = self._band_chunks
+        n_bands = -(-self.height // self.restart_interval)
+        if b >= n_bands:
+            raise ProtocolError("no band %d" % b)
+        while len(chunks) <= b:
+            # Skip the data and the CRC of the last known chunk.
+            offset = chunks[-1][0] + chunks[-1][1] + 4
+            self.file.seek(offset)
+            header = self.file.read(8)
+            if len(header) != 8:
+                raise FormatError(
+                    'End of file whilst reading chunk length and type.')
+            length, type = struct.unpack('!I4s', header)
+            if type != b'IDAT':
+                raise FormatError(
+                    "Restart points do not match the IDAT chunks.")
+            chunks.append((offset + 8, length))
+        offset, length = chunks[b]
+        self.file.seek(offset)
+        data = self.file.read(length)
+        checksum = self.file.read(4)
+        if len(data) != length or len(checksum) != 4:
+            raise ChunkError('IDAT chunk too short.')
+        self._verify_checksum(b'IDAT', data, checksum, lenient)
+
+        # The bands after the first start after a full flush point,
+        # as raw deflate data (no zlib header).
+        if b == 0:
+            d = zlib.decompressobj()
+        else:
+            d = zlib.decompressobj(-zlib.MAX_WBITS)
+        data = d.decompress(data)
+        n_rows = min(self.restart_interval,
+                     self.height - b * self.restart_interval)
+        if len(data) != n_rows * (self.row_bytes + 1):
+            raise FormatError(
+                "Restart points do not match the rows of the image.")
+        return data
+
     def palette(self, alpha='natural'):
         """
         Returns a palette that is a sequence of 3-tuples or 4-tuples,
@@ -1803,7 +2880,7 @@ class Reader:
             plte = list(map(operator.add, plte, group(trns, 1)))
         return plte
 
-    def asDirect(self):
+    def asDirect(self, sbit=True):
         """
         Returns the image data as a direct representation of
         an ``x * y * planes`` array.
@@ -1840,12 +2917,17 @@ class Reader:
         each row being a sequence of values
         (like the :meth:`read` method).
         All the other aspects of the image data are not changed.
+        If the optional `sbit` argument is false,
+        the ``sBIT`` chunk is ignored and the pixel values are
+        the ones stored in the file, with all their bits
+        (this is what steganography tools want,
+        and it saves a pass over the pixels).
         """
 
         self.preamble()
 
         # Simple case, no conversion necessary.
-        if not self.colormap and not self.trns and not self.sbit:
+        if not self.colormap and not self.trns and not (sbit and self.sbit):
             return self.read()
 
         x, y, pixels, info = self.read()
@@ -1861,39 +2943,31 @@ class Reader:
                 for row in pixels:
                     row = [plte[x] for x in row]
                     yield array('B', itertools.chain(*row))
-            pixels = iterpal(pixels)
+            pixels = instrument(self.stats, 'palette', iterpal(pixels))
         elif self.trns:
-            # It would be nice if there was some reasonable way
-            # of doing this without generating a whole load of
-            # intermediate tuples.  But tuples does seem like the
-            # easiest way, with no other way clearly much simpler or
-            # much faster.  (Actually, the L to LA conversion could
-            # perhaps go faster (all those 1-tuples!), but I still
-            # wonder whether the code proliferation is worth it)
+            # The alpha channel is computed in bulk, a whole row at
+            # a time, see :func:`convert_trns_to_alpha`.
             it = self.transparent
             maxval = 2 ** info['bitdepth'] - 1
             planes = info['planes']
             info['alpha'] = True
             info['planes'] += 1
-            typecode = 'BH'[info['bitdepth'] > 8]
+
+            if info['bitdepth'] > 8:
+                def newarray(n):
+                    return array('H', [0]) * n
+            else:
+                def newarray(n):
+                    return bytearray(n)
 
             def itertrns(pixels):
                 for row in pixels:
-                    # For each row we group it into pixels, then form a
-                    # characterisation vector that says whether each
-                    # pixel is opaque or not.  Then we convert
-                    # True/False to 0/maxval (by multiplication),
-                    # and add it as the extra channel.
-                    row = group(row, planes)
-                    opa = map(it.__ne__, row)
-                    opa = map(maxval.__mul__, opa)
-                    opa = list(zip(opa))    # convert to 1-tuples
-                    yield array(
-                        typecode,
-                        itertools.chain(*map(operator.add, row, opa)))
-            pixels = itertrns(pixels)
+                    a = newarray(len(row) // planes * (planes + 1))
+                    convert_trns_to_alpha(row, a, it, planes, maxval)
+                    yield a
+            pixels = instrument(self.stats, 'trns', itertrns(pixels))
         targetbitdepth = None
-        if self.sbit:
+        if sbit and self.sbit:
             sbit = struct.unpack('%dB' % len(self.sbit), self.sbit)
             targetbitdepth = max(sbit)
             if targetbitdepth > info['bitdepth']:
@@ -1907,14 +2981,14 @@ class Reader:
 
             def itershift(pixels):
                 for row in pixels:
-                    yield [p >> shift for p in row]
-            pixels = itershift(pixels)
+                    yield shift_row(row, shift)
+            pixels = instrument(self.stats, 'sbit', itershift(pixels))
         return x, y, pixels, info
 
-    def _as_rescale(self, get, targetbitdepth):
+    def _as_rescale(self, get, targetbitdepth, sbit=True):
         """Helper used by :meth:`asRGB8` and :meth:`asRGBA8`."""
 
-        width, height, pixels, info = get()
+        width, height, pixels, info = get(sbit=sbit)
         maxval = 2**info['bitdepth'] - 1
         targetmaxval = 2**targetbitdepth - 1
         factor = float(targetmaxval) / float(maxval)
@@ -1926,9 +3000,10 @@ class Reader:
         if maxval == targetmaxval:
             return width, height, pixels, info
         else:
-            return width, height, iterscale(), info
+            return (width, height,
+                    instrument(self.stats, 'rescale', iterscale()), info)
 
-    def asRGB8(self):
+    def asRGB8(self, sbit=True):
         """
         Return the image data as an RGB pixels with 8-bits per sample.
         This is like the :meth:`asRGB` method except that
@@ -1945,11 +3020,12 @@ class Reader:
         (*width*, *height*, *rows*, *info*).
         *width*, *height*, *info* are as per the :meth:`read` method.
         *rows* is the pixel data as a sequence of rows.
+        The `sbit` argument is passed to :meth:`asDirect`.
         """
 
-        return self._as_rescale(self.asRGB, 8)
+        return self._as_rescale(self.asRGB, 8, sbit)
 
-    def asRGBA8(self):
+    def asRGBA8(self, sbit=True):
         """
         Return the image data as RGBA pixels with 8-bits per sample.
         This method is similar to :meth:`asRGB8` and :meth:`asRGBA`:
@@ -1957,11 +3033,12 @@ class Reader:
         values are rescaled to the range 0 to 255.
         The alpha channel is synthesized if necessary
         (with a small speed penalty).
+        The `sbit` argument is passed to :meth:`asDirect`.
         """
 
-        return self._as_rescale(self.asRGBA, 8)
+        return self._as_rescale(self.asRGBA, 8, sbit)
 
-    def asRGB(self):
+    def asRGB(self, sbit=True):
         """
         Return image as RGB pixels.
         RGB colour images are passed through unchanged;
@@ -1972,9 +3049,10 @@ class Reader:
         the *info* reflect the returned pixels, not the source image.
         In particular,
         for this method ``info['greyscale']`` will be ``False``.
+        The `sbit` argument is passed to :meth:`asDirect`.
         """
 
-        width, height, pixels, info = self.asDirect()
+        width, height, pixels, info = self.asDirect(sbit)
         if info['alpha']:
             raise Error("will not convert image with alpha channel to RGB")
         if not info['greyscale']:
@@ -1995,9 +3073,10 @@ class Reader:
                 for i in range(3):
                     a[i::3] = row
                 yield a
-        return width, height, iterrgb(), info
+        return (width, height,
+                instrument(self.stats, 'convert', iterrgb()), info)
 
-    def asRGBA(self):
+    def asRGBA(self, sbit=True):
         """
         Return image as RGBA pixels.
         Greyscales are expanded into RGB triplets;
@@ -2007,9 +3086,10 @@ class Reader:
         In particular, for this method
         ``info['greyscale']`` will be ``False``, and
         ``info['alpha']`` will be ``True``.
+        The `sbit` argument is passed to :meth:`asDirect`.
         """
 
-        width, height, pixels, info = self.asDirect()
+        width, height, pixels, info = self.asDirect(sbit)
         if info['alpha'] and not info['greyscale']:
             return width, height, pixels, info
         typecode = 'BH'[info['bitdepth'] > 8]
@@ -2052,7 +3132,8 @@ class Reader:
         info['alpha'] = True
         info['greyscale'] = False
         info['planes'] = 4
-        return width, height, convert(), info
+        return (width, height,
+                instrument(self.stats, 'convert', convert()), info)
 
 
 def decompress(data_blocks):
@@ -2074,6 +3155,161 @@ def decompress(data_blocks):
     yield bytearray(d.flush())
 
 
+# The zlib stream held by the IDAT chunks ends with an Adler-32 checksum.
+# https://www.ietf.org/rfc/rfc1950.txt
+ADLER_BASE = 65521
+
+
+# The background thread shared by the readers deferring their
+# checksums, started on first use (see checksum_pool).
+_crc_pool = None
+_crc_pool_lock = _thread.allocate_lock()
+
+
+def checksum_pool():
+    """
+    Return the executor verifying the checksums deferred by
+    the ``'defer'`` policy of :class:`Reader`.
+    It is shared by all the readers, so a reader dropped before
+    :meth:`Reader.verify_checksums` leaves no thread behind.
+    """
+
+    global _crc_pool
+    with _crc_pool_lock:
+        if _crc_pool is None:
+            import concurrent.futures
+            _crc_pool = concurrent.futures.ThreadPoolExecutor(
+                1, thread_name_prefix='png-checksums')
+        return _crc_pool
+
+
+def mismatched_checksums(chunks):
+    """
+    Verify the checksums of `chunks`, a sequence of
+    (*type*, *data*, *checksum*) triples;
+    return the description of each mismatch.
+    """
+
+    errors = []
+    for type, data, expected in chunks:
+        actual = zlib.crc32(data, zlib.crc32(type))
+        if actual != expected:
+            errors.append("%s chunk: 0x%08X != 0x%08X"
+                          % (type.decode('ascii'), expected, actual))
+    return errors
+
+
+def stored_offset(idat_offset, block, k):
+    """
+    Return the offset in the file of the byte `k` of the zlib stream
+    (the filtered rows, without the zlib header) of an image written
+    by ``Writer(stored=True)``,
+    given the offset of its first ``IDAT`` chunk (of its length)
+    and the size of its stored blocks (see the ``stLO`` chunk).
+    Block *i* is in ``IDAT`` chunk *i*, after a 5 bytes header,
+    and the first chunk starts with the 2 bytes zlib header.
+    """
+
+    i, k = divmod(k, block)
+    # Length and type, then the data of the chunk; each chunk before
+    # has a 12 bytes frame, and holds a block with its header.
+    offset = idat_offset + i * (12 + 5 + block) + 8 + 5 + 2
+    return offset + k
+
+
+# The CRC-32 register after 2**k zero bytes, as a GF(2) matrix
+# (32 columns) for each k, computed as needed.
+_crc32_zeros = []
+
+
+def _gf2_times(matrix, vector):
+    total = 0
+    for column in matrix:
+        if not vector:
+            break
+        if vector & 1:
+            total ^= column
+        vector >>= 1
+    return total
+
+
+def crc32_shift(crc, n):
+    """
+    Return the CRC-32 register `crc` after `n` zero bytes,
+    without the initial and final conditioning of the CRC-32
+    (the CRC-32 is linear then, over GF(2)).
+    It takes a time in log(`n`),
+    by squaring the matrix of the zero bytes.
+    """
+
+    if not _crc32_zeros:
+        # One zero bit, then 2, 4 and 8 zero bits.
+        matrix = [0xedb88320] + [1 << k for k in range(31)]
+        for _ in range(3):
+            matrix = [_gf2_times(matrix, column) for column in matrix]
+        _crc32_zeros.append(matrix)
+    k = 0
+    while n:
+        while k >= len(_crc32_zeros):
+            matrix = _crc32_zeros[-1]
+            _crc32_zeros.append([_gf2_times(matrix, column)
+                                 for column in matrix])
+        if n & 1:
+            crc = _gf2_times(_crc32_zeros[k], crc)
+        n >>= 1
+        k += 1
+    return crc
+
+
+def crc32_replace(crc, old, new, after):
+    """
+    Return the CRC-32 of a byte string where a part was replaced
+    by another one of the same length,
+    given the CRC-32 of the whole string, the CRC-32 of the
+    old part and of the new part, and the number of bytes after
+    the part.
+    The other parts of the string are not needed:
+    the CRC-32 changes by the one of the difference of the parts,
+    shifted by the bytes after them.
+    """
+
+    return crc ^ crc32_shift(old ^ new, after)
+
+
+def adler32_combine(adler1, adler2, len2):
+    """
+    Return the Adler-32 of the concatenation of two byte strings,
+    given the Adler-32 of each of them
+    and the length of the second one.
+    """
+
+    rem = len2 % ADLER_BASE
+    a1, b1 = adler1 & 0xffff, adler1 >> 16
+    a2, b2 = adler2 & 0xffff, adler2 >> 16
+    a = (a1 + a2 - 1) % ADLER_BASE
+    b = (b1 + b2 + rem * (a1 - 1)) % ADLER_BASE
+    return (b << 16) | a
+
+
+def adler32_replace(adler, old, new, after):
+    """
+    Return the Adler-32 of a byte string where a part was replaced
+    by another one of the same length,
+    given the Adler-32 of the whole string, the Adler-32 of the
+    old part and of the new part, and the number of bytes after
+    the part.
+    The other parts of the string are not needed.
+    """
+
+    rem = after % ADLER_BASE
+    a, b = adler & 0xffff, adler >> 16
+    da = (new & 0xffff) - (old & 0xffff)
+    db = (new >> 16) - (old >> 16)
+    a = (a + da) % ADLER_BASE
+    b = (b + db + rem * da) % ADLER_BASE
+    return (b << 16) | a
+
+
 def check_bitdepth_colortype(bitdepth, colortype):
     """
     Check that `bitdepth` and `colortype` are both valid,
@@ -2202,6 +3438,81 @@ def convert_rgb_to_rgba(row, result):
         result[i::4] = row[i::3]
 
 
+def convert_trns_to_alpha(row, result, transparent, planes, maxval):
+    """
+    Copy the pixels of `row` into `result`,
+    which has room for one more channel per pixel,
+    and fill that alpha channel:
+    0 for the pixels of the `transparent` colour, `maxval` elsewhere.
+    `row` and `result` are both ``bytearray``, or both ``array('H')``.
+    """
+    for i in range(planes):
+        result[i::planes + 1] = row[i::planes]
+    if isarray(row):
+        itemsize = row.itemsize
+        samples = row.tobytes()
+    else:
+        itemsize = 1
+        samples = bytes(row)
+    stride = planes * itemsize
+    n = len(samples) // stride
+
+    # Compare every byte of every sample to the corresponding byte of
+    # the transparent colour, using translate to get 1 where they are
+    # equal and 0 elsewhere; the pixel is transparent when all the
+    # comparisons of its bytes are 1.
+    match = (1 << (8 * n)) - 1
+    for i, value in enumerate(transparent):
+        if value >> (8 * itemsize):
+            match = 0
+            break
+        for j, byte in enumerate(value.to_bytes(itemsize, sys.byteorder)):
+            table = bytearray(256)
+            table[byte] = 1
+            lane = samples[i * itemsize + j::stride].translate(table)
+            match &= int.from_bytes(lane, 'big')
+    transparent_pixels = match.to_bytes(n, 'big')
+
+    if itemsize == 1:
+        table = bytes([maxval, 0]) + bytes(254)
+        result[planes::planes + 1] = transparent_pixels.translate(table)
+    else:
+        table = bytes([0xff, 0]) + bytes(254)
+        lane = transparent_pixels.translate(table)
+        alpha = array('H')
+        alpha.frombytes(bytes(2 * n))
+        view = memoryview(alpha).cast('B')
+        view[0::2] = lane
+        view[1::2] = lane
+        result[planes::planes + 1] = alpha
+
+def shift_row(row, shift):
+    """
+    Return a fresh row with every value of `row` shifted right
+    by `shift` bits.
+    Rows of 8-bit values go through a translation table,
+    other rows through a single ``map``; no Python code runs per value.
+    """
+
+    if isarray(row) and row.itemsize > 1:
+        return array(row.typecode,
+                      map(operator.rshift, row, itertools.repeat(shift)))
+    return bytearray(row).translate(shift_tables[shift])
+
+
+# Translation tables for :func:`shift_row`, one per shift.
+shift_tables = [bytes(x >> shift for x in range(256)) for shift in range(8)]
+
+# Translation tables for :meth:`Reader.read_into`, one list per
+# bit depth less than 8: the k-th table extracts the k-th sample
+# (from the most significant bits) of each packed byte.
+unpack_tables = {
+    bitdepth: [bytes((x >> (8 - bitdepth * (k + 1))) & (2 ** bitdepth - 1)
+                     for x in range(256))
+               for k in range(8 // bitdepth)]
+    for bitdepth in (1, 2, 4)}
+
+
 # Only reason to include this in this module is that
 # several utilities need it, and it is small.
 def binary_stdin():
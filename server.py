@@ -0,0 +1,293 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+""" server.py: Resident LSB server, answering hide and find requests over HTTP
+
+usage: server.py [-h] [-p PORT | -u SOCKET] [-w WORKERS] [-m CACHE_MB]
+                 [-l PATH [PATH ...]] [-r ROOT] [--band-workers N] [-q]
+optional arguments:
+  -h, --help            show this help message and exit
+  -p PORT, --port PORT  Listen on this port of localhost (default: 8421)
+  -u SOCKET, --unix SOCKET
+                        Listen on this Unix socket instead
+  -w WORKERS, --workers WORKERS
+                        Number of worker threads (default: 4)
+  -m CACHE_MB, --cache-mb CACHE_MB
+                        Size of the decoded carriers cache, in MiB (default: 256)
+  -l PATH [PATH ...], --preload PATH [PATH ...]
+                        Decode these carriers at startup
+  -r ROOT, --root ROOT  Only read and write the carriers in this directory
+                        (default: the current directory)
+  --band-workers N      Threads inflating the bands of rows of each carrier
+                        decoded (default: 1)
+  -q, --quiet           Do not log the requests
+
+Endpoints (the carriers are paths on the machine running the server, relative
+to the root directory, and must be in it once their links are resolved):
+  POST /hide?src=SRC&dst=DST[&channels=RG&bits=4]
+        Hide the request body in SRC, and save the picture in DST.
+        The answer is a JSON object: {"bytes": ..., "partial": ...}
+  POST /find?src=SRC[&channels=RG&bits=4]
+        Answer the payload hidden in SRC.
+  GET /status
+        Answer the state of the carriers cache, as a JSON object.
+A payload is framed by its length, and sealed when the request has an
+X-Key header (see main.py -k). The interpreter, the modules and the
+decoded carriers stay loaded between requests, so a request only pays
+for its own work.
+The requests must be sent to localhost (Host header), and not by a web
+page (no Origin header): a page could otherwise make a browser send them.
+
+Author : Vincent Brignatz
+"""
+
+import argparse
+import concurrent.futures
+import http.server
+import json
+import os
+import signal
+import socketserver
+import stat
+import traceback
+import urllib.parse
+
+import cipher
+import lsb
+import png
+
+
+# Host headers of the requests sent to the server itself
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "[::1]")
+
+
+class Forbidden(Exception):
+    """ A request not sent from this machine, or for a path outside the root. """
+
+
+def param(query, name):
+    """ Value of a required parameter of the query string.
+        (Dict<str, str>, str) ~> (str)
+    """
+    if name not in query:
+        raise ValueError(f"The parameter '{name}' is required")
+    return query[name]
+
+
+class PoolMixIn:
+    """ Handle each request in a bounded pool of worker threads. """
+
+    def __init__(self, address, handler_class, workers=4):
+        # Before binding, which closes the server when it fails
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers)
+        super().__init__(address, handler_class)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+class TCPServer(PoolMixIn, http.server.HTTPServer):
+    pass
+
+
+class UnixServer(PoolMixIn, socketserver.UnixStreamServer):
+
+    def server_bind(self):
+        # A socket left by a previous run would make bind fail,
+        # any other file is not the server's to remove
+        if os.path.lexists(self.server_address):
+            if not is_socket(self.server_address):
+                raise FileExistsError(f"'{self.server_address}' exists and is not a socket")
+            os.unlink(self.server_address)
+        super().server_bind()
+
+    def server_close(self):
+        super().server_close()
+        if is_socket(self.server_address):
+            os.unlink(self.server_address)
+
+
+def is_socket(path):
+    """ Whether path is a Unix socket (and not a link to one).
+        (str) ~> (bool)
+    """
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """ Answer the hide, find and status requests.
+        The server has a cache (CarrierCache) and a quiet flag.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    # Errors of the requests, and the status they are answered with,
+    # any other one is answered with 500
+    ERRORS = (
+        (Forbidden, 403),
+        (FileNotFoundError, 404),
+        (PermissionError, 403),
+        (cipher.AuthenticationError, 403),
+        (lsb.CapacityError, 413),
+        (png.Error, 400),
+        (ValueError, 400),
+        (OSError, 400),
+    )
+
+    def address_string(self):
+        # The clients of a Unix socket have no address
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return "unix"
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def send(self, status, body, content_type="application/octet-stream"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, obj):
+        self.send(status, json.dumps(obj).encode("utf-8"), "application/json")
+
+    def check_origin(self):
+        """ Refuse the requests sent to another host (the name of a web
+            site resolving to this machine), or sent by a web page.
+        """
+        host = self.headers.get("Host", "").lower()
+        if host.rsplit(":", 1)[0] not in LOCAL_HOSTS and host not in LOCAL_HOSTS:
+            raise Forbidden(f"The requests must be sent to localhost, not '{host}'")
+        if "Origin" in self.headers:
+            raise Forbidden("The requests must not come from a web page")
+
+    def resolve(self, query, name):
+        """ Real path of a parameter of the query string, which must be
+            in the root directory of the server.
+            (Dict<str, str>, str) ~> (str)
+        """
+        root = self.server.root
+        path = os.path.realpath(os.path.join(root, param(query, name)))
+        if os.path.commonpath([root, path]) != root:
+            raise Forbidden(f"The path '{query[name]}' is outside the root directory")
+        return path
+
+    def answer_error(self, e):
+        for error, status in self.ERRORS:
+            if isinstance(e, error):
+                return self.send_json(status, {"error": str(e)})
+        self.log_error("%s", traceback.format_exc())
+        self.send_json(500, {"error": "Internal server error"})
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        try:
+            self.check_origin()
+        except Forbidden as e:
+            return self.answer_error(e)
+        if url.path != "/status":
+            return self.send_json(404, {"error": f"Unknown endpoint {url.path}"})
+        cache = self.server.cache
+        self.send_json(200, {"carriers": len(cache), "bytes": cache.n_bytes,
+                             "hits": cache.hits, "misses": cache.misses})
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        action = {"/hide": self.hide, "/find": self.find}.get(url.path)
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length < 0:
+                raise ValueError(f"Invalid Content-Length {length}")
+        except ValueError as e:
+            # The body cannot be skipped, neither can the next requests
+            self.close_connection = True
+            return self.answer_error(ValueError(f"Invalid Content-Length: {e}"))
+        body = self.rfile.read(length)
+        if action is None:
+            return self.send_json(404, {"error": f"Unknown endpoint {url.path}"})
+        query = dict(urllib.parse.parse_qsl(url.query))
+        try:
+            self.check_origin()
+            scheme = lsb.make_scheme(query.get("channels", "RG"), int(query.get("bits", 4)))
+            action(query, scheme, self.headers.get("X-Key"), body)
+        except Exception as e:
+            self.answer_error(e)
+
+    def hide(self, query, scheme, key, body):
+        src, dst = self.resolve(query, "src"), self.resolve(query, "dst")
+        data = lsb.pack_payload(body, key)
+        partial = lsb.hide_in_png(src, dst, data, scheme, self.server.cache)
+        self.send_json(200, {"bytes": len(body), "partial": partial})
+
+    def find(self, query, scheme, key, body):
+        raster = lsb.load_raster(self.resolve(query, "src"), self.server.cache)
+        self.send(200, lsb.find_payload(raster.buffer, key, scheme))
+
+
+def make_server(address, workers=4, cache=None, quiet=False, root=None):
+    """ Build the server listening on address: a (host, port) pair,
+        or the path of a Unix socket. It only reads and writes the
+        carriers in the directory root (the current one by default).
+        (Tuple|str, int, CarrierCache, bool, str) ~> (socketserver.BaseServer)
+    """
+    server_class = UnixServer if isinstance(address, str) else TCPServer
+    server = server_class(address, Handler, workers)
+    server.cache = cache if cache is not None else lsb.CarrierCache()
+    server.quiet = quiet
+    server.root = os.path.realpath(root if root is not None else os.getcwd())
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resident LSB server, answering hide and find requests over HTTP')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-p', "--port", type=int, default=8421,
+                       help='Listen on this port of localhost (default: 8421)')
+    group.add_argument('-u', "--unix", type=str, default=None, metavar="SOCKET",
+                       help='Listen on this Unix socket instead')
+    parser.add_argument('-w', "--workers", type=int, default=4,
+                        help='Number of worker threads (default: 4)')
+    parser.add_argument('-m', "--cache-mb", type=int, default=256,
+                        help='Size of the decoded carriers cache, in MiB (default: 256)')
+    parser.add_argument('-l', "--preload", type=str, nargs="+", default=[], metavar="PATH",
+                        help='Decode these carriers at startup')
+    parser.add_argument('-r', "--root", type=str, default=None,
+                        help='Only read and write the carriers in this directory (default: the current directory)')
+    parser.add_argument("--band-workers", type=int, default=1, metavar="N",
+                        help='Threads inflating the bands of rows of each carrier decoded (default: 1)')
+    parser.add_argument('-q', "--quiet", action="store_true",
+                        help='Do not log the requests')
+    args = parser.parse_args()
+
+    cache = lsb.CarrierCache(args.cache_mb * 2**20, args.band_workers)
+    for path in args.preload:
+        cache.get(path)
+    address = args.unix if args.unix is not None else ("127.0.0.1", args.port)
+    # Stopping the server (SIGTERM) closes it, and removes its socket
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    with make_server(address, args.workers, cache, args.quiet, args.root) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()
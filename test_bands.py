@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+""" test_bands.py: Checks of the partial re-encoding of png files with restart points
+
+lsb.reencode_bands decodes and compresses again only the bands of rows
+holding the data, splices them between the other ones, and patches the
+Adler-32 of the image data.
+Run with: python -m pytest test_bands.py
+
+Author : Vincent Brignatz
+"""
+
+import os
+import random
+import zlib
+
+import pytest
+
+import lsb
+import png
+
+
+def write_banded(path, width, height, pixels, interval=lsb.RESTART_INTERVAL):
+    with open(path, "wb") as f:
+        lsb.write_rgba(f, width, height, pixels, restart_interval=interval)
+
+def write_filtered(path, width, height, pixels, interval, filter_type):
+    """ An RGBA png with restart points whose bands after the first start
+        with a row filtered with filter_type (2: Up, 3: Average), against
+        the last row of the band above.
+    """
+    rb = 4 * width
+    rows = [pixels[y * rb:(y + 1) * rb] for y in range(height)]
+    compressor = zlib.compressobj()
+    with open(path, "wb") as f:
+        png.Writer(width, height, greyscale=False, alpha=True,
+                   restart_interval=interval).write_preamble(f)
+        for start in range(0, height, interval):
+            band = bytearray()
+            for y in range(start, min(start + interval, height)):
+                if y == start and y:
+                    up = rows[y - 1]
+                    if filter_type == 2:
+                        line = bytes((x - u) & 0xff for x, u in zip(rows[y], up))
+                    else:
+                        left = bytes(4) + rows[y][:-4]
+                        line = bytes((x - (a + u) // 2) & 0xff for x, a, u in zip(rows[y], left, up))
+                    band.append(filter_type)
+                    band += line
+                else:
+                    band.append(0)
+                    band += rows[y]
+            last = start + interval >= height
+            png.write_chunk(f, b'IDAT', compressor.compress(band) +
+                            compressor.flush(zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH))
+        png.write_chunk(f, b'IEND')
+
+def read_strict(path):
+    """ The flat pixels of path, its CRC-32 and Adler-32 all checked. """
+    r = png.Reader(filename=path, verify="full")
+    width, height, rows, info = r.asDirect()
+    return lsb.flatten(rows)
+
+def random_pixels(width, height, seed=0):
+    rng = random.Random(seed)
+    return bytearray(rng.getrandbits(8) for _ in range(4 * width * height))
+
+
+@pytest.mark.parametrize("width, height, n_bytes", [
+    (50, 100, 10),
+    # The data reaches the second band
+    (50, 100, 2000),
+    # Only the last band, which holds the Adler-32, is partial
+    (40, 70, 1500),
+])
+def test_embed_twice(tmp_path, width, height, n_bytes):
+    src, mid, dst = (str(tmp_path / name) for name in ("src.png", "mid.png", "dst.png"))
+    pixels = random_pixels(width, height)
+    write_banded(src, width, height, pixels)
+    for path_in, path_out, seed in ((src, mid, 1), (mid, dst, 2)):
+        payload = random.Random(seed).randbytes(n_bytes)
+        data = lsb.pack_payload(payload)
+        assert lsb.hide_in_png(path_in, path_out, data)
+        lsb.hide_bytes(pixels, data)
+        assert read_strict(path_out) == pixels
+        assert lsb.extract(path_out) == payload
+
+def test_embed_in_last_band(tmp_path):
+    # A region in the last band: the first and the last bands are
+    # encoded again, the Adler-32 is patched for both
+    src, dst = str(tmp_path / "src.png"), str(tmp_path / "dst.png")
+    width, height = 60, 100
+    pixels = random_pixels(width, height)
+    write_banded(src, width, height, pixels)
+    payload = os.urandom(200)
+    rect = (0, 96, width, 4)
+    assert lsb.hide_in_png(src, dst, payload, region=rect)
+    runs, pieces = lsb.region_layout(payload, rect, width, height)
+    lsb.write_runs(pixels, width, 0, runs, pieces)
+    assert read_strict(dst) == pixels
+    assert lsb.extract(dst, region=True) == payload
+
+@pytest.mark.parametrize("filter_type", [2, 3])
+def test_next_band_filtered_against_touched_one(tmp_path, filter_type):
+    # Band 1 starts with a row referring to the last row of band 0,
+    # which the data changes: band 1 cannot be copied as it is
+    src, dst = str(tmp_path / "src.png"), str(tmp_path / "dst.png")
+    width, height = 10, 64
+    pixels = random_pixels(width, height)
+    write_filtered(src, width, height, pixels, 32, filter_type)
+    assert read_strict(src) == pixels
+    payload = os.urandom(312)
+    lsb.hide_in_png(src, dst, lsb.pack_payload(payload))
+    lsb.hide_bytes(pixels, lsb.pack_payload(payload))
+    assert read_strict(dst) == pixels
+    assert lsb.extract(dst) == payload
+
+def test_reencode_bands_refuses_dependent_band(tmp_path):
+    path = str(tmp_path / "src.png")
+    write_filtered(path, 10, 64, random_pixels(10, 64), 32, 2)
+    with open(path, "rb") as f:
+        assert lsb.reencode_bands(f, lsb.pack_payload(bytes(100))) is None
+
+def test_split_idat_falls_back(tmp_path):
+    # IDAT chunks split since they were written are not bands
+    src, dst = str(tmp_path / "src.png"), str(tmp_path / "dst.png")
+    width, height = 30, 70
+    pixels = random_pixels(width, height)
+    write_banded(src, width, height, pixels)
+    chunks = list(png.Reader(filename=src).chunks())
+    with open(src, "wb") as f:
+        f.write(png.signature)
+        for type, data in chunks:
+            if type == b'IDAT':
+                png.write_chunk(f, type, data[:len(data) // 2])
+                png.write_chunk(f, type, data[len(data) // 2:])
+            else:
+                png.write_chunk(f, type, data)
+    payload = os.urandom(50)
+    assert not lsb.hide_in_png(src, dst, lsb.pack_payload(payload))
+    assert lsb.extract(dst) == payload
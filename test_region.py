@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+""" test_region.py: Checks of the payloads written in a rectangle of pixels
+
+lsb.region_layout and lsb.choose_region place the payload, behind its
+REGION header, lsb.find_region reads it back with png.Reader.read_rows.
+Run with: python -m pytest test_region.py
+
+Author : Vincent Brignatz
+"""
+
+import os
+import random
+from array import array
+
+import pytest
+
+import lsb
+import png
+
+
+def random_pixels(width, height, bitdepth=8, seed=0):
+    rng = random.Random(seed)
+    n = 4 * width * height
+    if bitdepth == 16:
+        return array("H", (rng.getrandbits(16) for _ in range(n)))
+    return bytearray(rng.getrandbits(8) for _ in range(n))
+
+def write_carrier(path, width, height, pixels, restart_interval):
+    with open(path, "wb") as f:
+        lsb.write_rgba(f, width, height, pixels, restart_interval=restart_interval)
+
+def read_pixels(path):
+    """ The flat pixels of path, its CRC-32 and Adler-32 all checked. """
+    r = png.Reader(filename=path, verify="full")
+    width, height, rows, info = r.asDirect()
+    return lsb.flatten(rows, "H" if info["bitdepth"] == 16 else None)
+
+
+@pytest.mark.parametrize("restart_interval", [lsb.RESTART_INTERVAL, 8, None])
+@pytest.mark.parametrize("rect", [(0, 4, 100, 10), (17, 40, 33, 50), (99, 100, 1, 20)])
+def test_explicit_region(tmp_path, restart_interval, rect):
+    src, dst = str(tmp_path / "src.png"), str(tmp_path / "dst.png")
+    width, height = 100, 120
+    pixels = random_pixels(width, height)
+    write_carrier(src, width, height, pixels, restart_interval)
+    payload = os.urandom(min(300, rect[2] * rect[3] // 2))
+
+    lsb.embed(src, dst, payload, region=rect)
+    runs, pieces = lsb.region_layout(payload, rect, width, height)
+    lsb.write_runs(pixels, width, 0, runs, pieces)
+    assert read_pixels(dst) == pixels
+    assert lsb.extract(dst, region=True) == payload
+
+@pytest.mark.parametrize("restart_interval, textured, n_bytes", [
+    # 32 rows, more than the band of the REGION header has left: one
+    # more band is encoded again, the textured one (scored as a whole)
+    (lsb.RESTART_INTERVAL, (64, 96), 2500),
+    (None, (80, 160), 500),
+])
+@pytest.mark.parametrize("bitdepth", [8, 16])
+def test_automatic_region(tmp_path, restart_interval, textured, n_bytes, bitdepth):
+    src, dst = str(tmp_path / "src.png"), str(tmp_path / "dst.png")
+    width, height = 80, 160
+    vpr = 4 * width
+    pixels = random_pixels(width, height, bitdepth)
+    # Only the textured rows are not flat
+    lo, hi = textured[0] * vpr, textured[1] * vpr
+    for a, b in ((0, lo), (hi, len(pixels))):
+        pixels[a:b] = array("H", [0]) * (b - a) if bitdepth == 16 else bytearray(b - a)
+    write_carrier(src, width, height, pixels, restart_interval)
+    payload = os.urandom(n_bytes)
+
+    lsb.embed(src, dst, payload, region=True)
+    assert lsb.extract(dst, region=True) == payload
+    # The rows below the header that changed are all textured ones
+    written = read_pixels(dst)
+    changed = [y for y in range(height) if written[y * vpr:(y + 1) * vpr] != pixels[y * vpr:(y + 1) * vpr]]
+    top = lsb.rows_touched(lsb.REGION.size, width)
+    assert all(textured[0] <= y < textured[1] for y in changed if y >= top)
+
+def test_choose_region():
+    width = 10
+    texture = [0] * 64 + [100] * 32 + [0] * 32
+    assert lsb.choose_region(texture, 50, width) == (0, 64, width, 5)
+    # With restart points, the band of the header comes first
+    x, y, w, h = lsb.choose_region(texture, 50, width, interval=32)
+    assert (x, w, h) == (0, width, 5) and y + h <= 32
+
+def test_region_too_small(tmp_path):
+    src = str(tmp_path / "src.png")
+    write_carrier(src, 50, 50, random_pixels(50, 50), lsb.RESTART_INTERVAL)
+    with pytest.raises(lsb.CapacityError):
+        lsb.embed(src, str(tmp_path / "dst.png"), bytes(100), region=(0, 10, 5, 5))
+    with pytest.raises(ValueError):
+        lsb.embed(src, str(tmp_path / "dst.png"), b"x", region=(0, 0, 5, 5))
+
+@pytest.mark.parametrize("restart_interval", [lsb.RESTART_INTERVAL, None])
+def test_no_region_header(tmp_path, restart_interval):
+    src, dst = str(tmp_path / "src.png"), str(tmp_path / "dst.png")
+    write_carrier(src, 60, 60, random_pixels(60, 60), restart_interval)
+    with pytest.raises(lsb.CapacityError):
+        lsb.extract(src, region=True)
+    lsb.embed(src, dst, b"not in a region")
+    with pytest.raises(lsb.CapacityError):
+        lsb.extract(dst, region=True)
+
+def test_region_false_is_no_region(tmp_path):
+    src, dst = str(tmp_path / "src.png"), str(tmp_path / "dst.png")
+    write_carrier(src, 30, 30, random_pixels(30, 30), lsb.RESTART_INTERVAL)
+    lsb.embed(src, dst, b"framed", region=False)
+    assert lsb.extract(dst, region=False) == b"framed"
+
+@pytest.mark.parametrize("restart_interval", [lsb.RESTART_INTERVAL, 5, None])
+@pytest.mark.parametrize("start, stop", [(0, 1), (3, 40), (31, 33), (64, 70), (69, 70), (10, 10)])
+def test_read_rows(tmp_path, restart_interval, start, stop):
+    path = str(tmp_path / "src.png")
+    width, height = 20, 70
+    pixels = random_pixels(width, height, 16)
+    write_carrier(path, width, height, pixels, restart_interval)
+    raster = png.Reader(filename=path).read_rows(start, stop)
+    assert (raster.width, raster.height) == (width, stop - start)
+    assert list(raster.buffer) == list(pixels[start * 4 * width:stop * 4 * width])
+
+def test_read_rows_many_times(tmp_path):
+    # The offsets of the bands are kept between the calls
+    path = str(tmp_path / "src.png")
+    width, height = 20, 100
+    pixels = random_pixels(width, height)
+    write_carrier(path, width, height, pixels, 10)
+    r = png.Reader(filename=path)
+    for start, stop in ((50, 60), (0, 5), (95, 100), (12, 48)):
+        assert r.read_rows(start, stop).buffer == pixels[start * 4 * width:stop * 4 * width]
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+""" test_stored.py: Checks of the stored carriers, patched in place
+
+The CRC-32 arithmetic of png.py, the offsets of the samples of a
+carrier written with png.Writer(stored=True), and lsb.patch_stored.
+Run with: python -m pytest test_stored.py
+
+Author : Vincent Brignatz
+"""
+
+import os
+import random
+import zlib
+from array import array
+
+import pytest
+
+import lsb
+import png
+
+
+def random_pixels(width, height, bitdepth, rng):
+    n = 4 * width * height
+    if bitdepth == 16:
+        return array("H", (rng.getrandbits(16) for _ in range(n)))
+    return bytearray(rng.getrandbits(8) for _ in range(n))
+
+def write_stored(path, width, height, bitdepth, seed=0):
+    pixels = random_pixels(width, height, bitdepth, random.Random(seed))
+    with open(path, "wb") as f:
+        lsb.write_rgba(f, width, height, pixels, stored=True)
+    return pixels
+
+def read_strict(path):
+    """ The flat pixels of path, its CRC-32 and Adler-32 all checked. """
+    r = png.Reader(filename=path, verify="full")
+    width, height, rows, info = r.asDirect()
+    return lsb.flatten(rows, "H" if info["bitdepth"] == 16 else "B")
+
+
+def test_crc32_replace():
+    rng = random.Random(1)
+    for _ in range(200):
+        data = bytearray(rng.getrandbits(8) for _ in range(rng.randrange(1, 3000)))
+        start = rng.randrange(len(data))
+        stop = rng.randrange(start, len(data)) + 1
+        old = bytes(data[start:stop])
+        new = bytes(rng.getrandbits(8) for _ in old)
+        crc = zlib.crc32(data)
+        data[start:stop] = new
+        assert png.crc32_replace(crc, zlib.crc32(old), zlib.crc32(new), len(data) - stop) == zlib.crc32(data)
+
+def test_crc32_shift_is_linear():
+    rng = random.Random(2)
+    for n in (0, 1, 7, 8, 1000, 2**20 + 3):
+        a, b = rng.getrandbits(32), rng.getrandbits(32)
+        assert png.crc32_shift(a ^ b, n) == png.crc32_shift(a, n) ^ png.crc32_shift(b, n)
+
+@pytest.mark.parametrize("width, height, bitdepth", [(40, 30, 8), (33, 20, 16), (17000, 3, 8)])
+def test_stored_offset(tmp_path, width, height, bitdepth):
+    path = str(tmp_path / "stored.png")
+    pixels = write_stored(path, width, height, bitdepth)
+    with open(path, "rb") as f:
+        r = png.Reader(file=f)
+        r.preamble()
+        idat = f.tell() - 8
+        data = open(path, "rb").read()
+    size = bitdepth // 8
+    row_bytes = 4 * width * size + 1
+    for y in range(height):
+        assert data[png.stored_offset(idat, r.stored_block, y * row_bytes)] == 0
+        for i in random.Random(y).sample(range(4 * width), 20):
+            k = y * row_bytes + 1 + i * size
+            sample = bytes(data[png.stored_offset(idat, r.stored_block, j)] for j in range(k, k + size))
+            assert int.from_bytes(sample, "big") == pixels[y * 4 * width + i]
+
+@pytest.mark.parametrize("width, height, bitdepth, region", [
+    (200, 100, 8, None),
+    (123, 77, 16, None),
+    (200, 100, 8, (3, 10, 150, 80)),
+    (9000, 5, 16, None),
+    # A stream of exactly one, then two stored blocks (255 rows of 257 bytes)
+    (64, 255, 8, None),
+    (32, 510, 16, (0, 4, 32, 500)),
+])
+def test_patch_stored(tmp_path, width, height, bitdepth, region):
+    src, dst = str(tmp_path / "src.png"), str(tmp_path / "dst.png")
+    pixels = write_stored(src, width, height, bitdepth)
+    scheme = lsb.make_scheme("RGB", 2)
+    payload = os.urandom(min(3000, width * height // 8))
+    data = lsb.pack_payload(payload) if region is None else payload
+
+    assert lsb.hide_in_png(src, dst, data, scheme, region=region)
+    if region is None:
+        lsb.hide_bytes(pixels, data, scheme)
+    else:
+        runs, pieces = lsb.region_layout(data, region, width, height, scheme)
+        lsb.write_runs(pixels, width, 0, runs, pieces, scheme)
+    assert read_strict(dst) == pixels
+    assert lsb.extract(dst, channels="RGB", bits=2, region=region is not None) == payload
+
+@pytest.mark.parametrize("width, height, bitdepth, n_blocks", [(64, 255, 8, 1), (32, 510, 16, 2)])
+def test_exact_blocks(tmp_path, width, height, bitdepth, n_blocks):
+    # The stream of the rows fills its stored blocks exactly
+    path = str(tmp_path / "stored.png")
+    pixels = write_stored(path, width, height, bitdepth)
+    assert height * (4 * width * bitdepth // 8 + 1) == n_blocks * png.STORED_BLOCK
+    chunks = [type for type, _ in png.Reader(filename=path).chunks()]
+    assert chunks.count(b"IDAT") == n_blocks
+    assert read_strict(path) == pixels
+
+def test_patch_in_place(tmp_path):
+    path = str(tmp_path / "stored.png")
+    write_stored(path, 100, 50, 8)
+    lsb.embed(path, path, b"in place", key="k")
+    read_strict(path)
+    assert lsb.extract(path, key="k") == b"in place"
+
+def test_capacity_keeps_dst(tmp_path):
+    src, dst = str(tmp_path / "src.png"), str(tmp_path / "dst.png")
+    write_stored(src, 20, 10, 8)
+    with open(dst, "wb") as f:
+        f.write(b"kept")
+    with pytest.raises(lsb.CapacityError):
+        lsb.hide_in_png(src, dst, bytes(1000))
+    assert open(dst, "rb").read() == b"kept"
+    assert sorted(os.listdir(tmp_path)) == ["dst.png", "src.png"]